@@ -0,0 +1,32 @@
+from django.urls import URLPattern, URLResolver
+
+from .async_views import async_read_view
+from .urls import urlpatterns as sync_urlpatterns
+
+# Маршруты чтения, которые под ASGI обслуживаются асинхронно
+ASYNC_VIEW_NAMES = {
+    'recipes-list', 'recipes-detail', 'recipes-feed',
+    'tag-list', 'tag-detail',
+    'ingredient-list', 'ingredient-detail',
+    'user-subscriptions',
+}
+
+
+def make_async(patterns):
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern, make_async(pattern.url_patterns),
+                pattern.default_kwargs, pattern.app_name, pattern.namespace
+            )
+        elif pattern.name in ASYNC_VIEW_NAMES:
+            pattern = URLPattern(
+                pattern.pattern, async_read_view(pattern.callback),
+                pattern.default_args, pattern.name
+            )
+        result.append(pattern)
+    return result
+
+
+urlpatterns = make_async(sync_urlpatterns)
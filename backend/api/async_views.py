@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .instrumentation import render_response
+
+# Потоки для чтения; их число ограничивает и число подключений к БД
+read_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_READ_THREADS,
+    thread_name_prefix='async-read',
+)
+
+
+def call_view(view, request, *args, **kwargs):
+    """Синхронное представление в потоке пула.
+
+    Обработчик ASGI закрывает подключения к БД только в своем потоке,
+    поэтому устаревшие подключения потока пула закрываются здесь. Ответ
+    рендерится в том же потоке, а не в событийном цикле.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            render_response(response)
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(view):
+    """Асинхронная версия представления для ASGI.
+
+    GET, HEAD и OPTIONS выполняются параллельно в пуле read_executor,
+    пока событийный цикл принимает другие запросы. Запись выполняется
+    как обычное синхронное представление под ASGI - в общем потоке.
+    """
+    read = sync_to_async(
+        call_view, thread_sensitive=False, executor=read_executor
+    )
+    write = sync_to_async(view, thread_sensitive=True)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await read(view, request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+    return wrapper
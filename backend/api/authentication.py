@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_KEY = 'auth-token:{}'
+# Кэш процесса: значения хранятся копиями, запросы не делят объекты
+local_cache = LocMemCache('auth-tokens', {'OPTIONS': {'MAX_ENTRIES': 10000}})
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса Token JOIN User на каждый запрос.
+
+    Токен с пользователем хранится в памяти процесса AUTH_TOKEN_LOCAL_TTL
+    секунд и, при AUTH_TOKEN_SHARED_CACHE, в общем кэше
+    AUTH_TOKEN_CACHE_TTL секунд. Сигналы (api/signals.py) сбрасывают
+    записи при удалении токена, смене пароля, деактивации пользователя
+    и изменении его прав;
+    в других процессах запись из памяти живет до конца своего срока,
+    то есть не дольше AUTH_TOKEN_LOCAL_TTL, если общий кэш действительно
+    общий для процессов.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = TOKEN_KEY.format(key)
+        token = local_cache.get(cache_key)
+        if token is None and settings.AUTH_TOKEN_SHARED_CACHE:
+            token = cache.get(cache_key)
+            if token is not None:
+                local_cache.set(
+                    cache_key, token, settings.AUTH_TOKEN_LOCAL_TTL
+                )
+        if token is None:
+            # Неизвестный токен или неактивный пользователь - исключение
+            _, token = super().authenticate_credentials(key)
+            local_cache.set(cache_key, token, settings.AUTH_TOKEN_LOCAL_TTL)
+            if settings.AUTH_TOKEN_SHARED_CACHE:
+                cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TTL)
+        return token.user, token
+
+
+def invalidate_tokens(keys):
+    """Сбросить кэш токенов после фиксации транзакции"""
+    cache_keys = [TOKEN_KEY.format(key) for key in keys]
+    if not cache_keys:
+        return
+
+    def invalidate():
+        local_cache.delete_many(cache_keys)
+        if settings.AUTH_TOKEN_SHARED_CACHE:
+            cache.delete_many(cache_keys)
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,53 @@
+"""Бюджеты запросов к БД.
+
+Представление объявляет бюджет для своих действий в query_budgets,
+например {'list': 5, 'retrieve': 4}. InstrumentationMiddleware
+сравнивает с ним число запросов каждого ответа: превышение пишется
+в лог и в статистику, а с QUERY_BUDGET_STRICT = True вызывает
+QueryBudgetExceeded. В тестах так регрессии роняют набор (бюджеты
+представлений замеряет api/tests.py, QueryBudgetTest):
+
+    @strict_query_budgets
+    class RecipesTest(APITestCase):
+        def test_list(self):
+            self.client.get('/api/recipes/')
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+
+strict_query_budgets = override_settings(QUERY_BUDGET_STRICT=True)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_query_budget(view, method):
+    """Бюджет действия представления из resolver_match.func или None"""
+    budgets = getattr(getattr(view, 'cls', None), 'query_budgets', None)
+    if not budgets:
+        return None
+    # Для ViewSet - действие по методу, для APIView - сам метод
+    action = getattr(view, 'actions', {}).get(method.lower(), method.lower())
+    return budgets.get(action)
+
+
+def check_query_budget(endpoint, queries, budget):
+    if budget is not None and queries > budget:
+        raise QueryBudgetExceeded(
+            f'{endpoint}: {queries} запросов к БД при бюджете {budget}'
+        )
+
+
+@contextmanager
+def query_budget(budget, using=DEFAULT_DB_ALIAS):
+    """Не больше budget запросов к БД внутри блока"""
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    if len(context) > budget:
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        raise QueryBudgetExceeded(
+            f'{len(context)} запросов к БД при бюджете {budget}:\n{queries}'
+        )
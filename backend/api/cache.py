@@ -0,0 +1,137 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+
+from app.versions import get_versions
+
+from .utils import get_subscriptions
+
+# Области данных, от которых зависит общая часть списка рецептов
+RECIPE_LIST_SCOPES = ('recipes', 'tags', 'ingredients', 'users')
+# Счетчики избранного меняются без смены версии recipes: от них зависят
+# только страницы, отсортированные по этим счетчикам
+FAVORITES_ORDERING_SCOPES = (*RECIPE_LIST_SCOPES, 'favorites')
+# Фильтры, результат которых зависит от пользователя
+VIEWER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def is_shared_recipe_list(request):
+    """Можно ли отдать запрошенную страницу из общего кэша"""
+    return not any(request.GET.get(name) for name in VIEWER_FILTERS)
+
+
+def get_recipe_list_scopes(request, **kwargs):
+    """Области данных страницы списка рецептов с учетом сортировки"""
+    if 'favorites_count' in request.GET.get('ordering', ''):
+        return FAVORITES_ORDERING_SCOPES
+    return RECIPE_LIST_SCOPES
+
+
+def get_recipe_list_cache_key(request):
+    scopes = get_recipe_list_scopes(request)
+    # Версии, уже прочитанные conditional_get, не запрашиваются повторно
+    known = getattr(request, 'data_versions', {})
+    if all(scope in known for scope in scopes):
+        versions = {scope: known[scope] for scope in scopes}
+    else:
+        versions = get_versions(*scopes)
+    params = sorted(
+        (name, value) for name in request.GET
+        for value in request.GET.getlist(name)
+    )
+    key = json.dumps([
+        request.get_host(), request.is_secure(),
+        sorted(versions.items()), params
+    ])
+    return 'recipes:list:' + hashlib.md5(key.encode()).hexdigest()
+
+
+def get_cached_recipe_list(request, build):
+    """Общая для всех пользователей страница списка рецептов.
+
+    Страница хранится в кэше (CACHES) под ключом с версиями данных из
+    общей для процессов таблицы, поэтому изменения из любого процесса,
+    в том числе из runjobs и команд управления, сразу дают новый ключ.
+    build() вызывается при промахе кэша и должен вернуть данные страницы
+    без учета пользователя.
+    """
+    key = get_recipe_list_cache_key(request)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.RECIPES_CACHE_TIMEOUT)
+    return data
+
+
+def apply_viewer_overlay(data, user):
+    """Проставить в странице флаги, зависящие от пользователя"""
+    if user.is_anonymous:
+        return data
+
+    recipes = data['results']
+    recipe_ids = [recipe['id'] for recipe in recipes]
+    favorites = set(user.favorites.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    cart = set(user.cart.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    subscriptions = get_subscriptions(
+        user, [recipe['author']['id'] for recipe in recipes]
+    )
+
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in favorites
+        recipe['is_in_shopping_cart'] = recipe['id'] in cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in subscriptions
+        )
+    return data
+
+
+def conditional_get(*scopes):
+    """ETag для GET по версиям областей данных.
+
+    scopes - области, от которых зависит ответ; в них подставляются
+    аргументы из URL (например, 'recipe:{pk}'). Вместо области можно
+    передать функцию (request, **kwargs), возвращающую несколько
+    областей в зависимости от запроса. Для авторизованного
+    пользователя добавляется его собственная область. Если у клиента
+    актуальная версия, ответ 304 отдается до обращения к queryset.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            request_scopes = []
+            for scope in scopes:
+                if callable(scope):
+                    request_scopes.extend(scope(request, **kwargs))
+                else:
+                    request_scopes.append(scope.format(**kwargs))
+            if request.user.is_authenticated:
+                request_scopes.append(f'viewer:{request.user.pk}')
+            versions = get_versions(*request_scopes)
+            request.data_versions = versions
+            etag = '"{}"'.format(hashlib.md5(json.dumps([
+                request.get_host(), request.get_full_path(),
+                request.user.pk, sorted(versions.items())
+            ]).encode()).hexdigest())
+
+            # Без Last-Modified: с точностью до секунды он отдал бы 304
+            # после изменения в ту же секунду
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+            # Браузер должен каждый раз уточнять актуальность ответа
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# Замеры текущего запроса. ContextVar видна и в потоках sync_to_async,
+# где работают асинхронные представления чтения
+current_stats = ContextVar('request_stats', default=None)
+
+# Общая статистика процесса: {'GET recipes-list': {...}}
+endpoint_stats = {}
+endpoint_stats_lock = threading.Lock()
+SUMMED_FIELDS = (
+    'requests', 'queries', 'db_time', 'render_time', 'app_time',
+    'total_time', 'over_budget',
+)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'render_time', 'total_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = self.render_time = self.total_time = 0.0
+
+    @property
+    def app_time(self):
+        """Время представления без запросов к БД и рендера"""
+        return max(self.total_time - self.db_time - self.render_time, 0.0)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Приемник connection_created: учет запросов подключения.
+
+    Обертка ставится первой: connection.execute_wrapper() снимает
+    последнюю, а подключение может открыться внутри такого блока.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def render_response(response):
+    """Рендер ответа с учетом его времени в замерах запроса"""
+    started = time.perf_counter()
+    response.render()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.render_time += time.perf_counter() - started
+
+
+def record_endpoint(endpoint, stats, budget):
+    over_budget = budget is not None and stats.queries > budget
+    with endpoint_stats_lock:
+        item = endpoint_stats.get(endpoint)
+        if item is None:
+            item = endpoint_stats[endpoint] = dict.fromkeys(
+                SUMMED_FIELDS, 0
+            )
+            item.update(queries_max=0, total_time_max=0.0)
+        item['requests'] += 1
+        item['over_budget'] += over_budget
+        for field in SUMMED_FIELDS[1:-1]:
+            item[field] += getattr(stats, field)
+        item['queries_max'] = max(item['queries_max'], stats.queries)
+        item['total_time_max'] = max(item['total_time_max'], stats.total_time)
+        item['budget'] = budget
+
+
+def get_endpoint_stats():
+    """Средние по представлениям текущего процесса, время в мс"""
+    with endpoint_stats_lock:
+        items = [(key, dict(item)) for key, item in endpoint_stats.items()]
+    result = []
+    for endpoint, item in sorted(items):
+        requests = item['requests']
+        result.append({
+            'endpoint': endpoint,
+            'requests': requests,
+            'queries': round(item['queries'] / requests, 2),
+            'queries_max': item['queries_max'],
+            'budget': item['budget'],
+            'over_budget': item['over_budget'],
+            **{
+                field: round(item[field] / requests * 1000, 2)
+                for field in ('db_time', 'render_time', 'app_time',
+                              'total_time')
+            },
+            'total_time_max': round(item['total_time_max'] * 1000, 2),
+        })
+    return {'pid': os.getpid(), 'endpoints': result}
+
+
+def reset_endpoint_stats():
+    with endpoint_stats_lock:
+        endpoint_stats.clear()
@@ -0,0 +1,105 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncClient, Client, override_settings
+from rest_framework.authtoken.models import Token
+
+DEFAULT_URLS = ('/api/recipes/', '/api/tags/', '/api/ingredients/?name=са')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение пропускной способности чтения API в одном процессе: '
+        'синхронные представления в потоках и асинхронные '
+        '(foodgram.urls_async); серверы gunicorn и uvicorn не сравнивает'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', dest='urls',
+            help='Адрес для запросов (можно указать несколько раз)'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Запросов на каждый адрес'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='Одновременных запросов (потоков в синхронном режиме)'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='Выполнять запросы от имени пользователя (id)'
+        )
+
+    def handle(self, *args, **options):
+        self.requests = options['requests']
+        self.concurrency = options['concurrency']
+        self.token = None
+        if options['user'] is not None:
+            self.token, _ = Token.objects.get_or_create(
+                user_id=options['user']
+            )
+        for url in options['urls'] or DEFAULT_URLS:
+            self.stdout.write(url)
+            self.report('sync', self.run_sync(url))
+            with override_settings(ROOT_URLCONF='foodgram.urls_async'):
+                self.report('async', asyncio.run(self.run_async(url)))
+
+    def get_sync(self, client, url):
+        started = time.perf_counter()
+        response = client.get(url)
+        # Как обработчик WSGI после ответа
+        close_old_connections()
+        return self.get_latency(response, started)
+
+    def run_sync(self, url):
+        extra = {}
+        if self.token:
+            extra['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+        client = Client(**extra)
+        self.get_sync(client, url)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            latencies = list(executor.map(
+                lambda _: self.get_sync(client, url), range(self.requests)
+            ))
+        return latencies, time.perf_counter() - started
+
+    async def run_async(self, url):
+        extra = {}
+        if self.token:
+            extra['authorization'] = f'Token {self.token.key}'
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url, **extra)
+                return self.get_latency(response, started)
+
+        await get()
+        started = time.perf_counter()
+        latencies = await asyncio.gather(
+            *(get() for _ in range(self.requests))
+        )
+        return latencies, time.perf_counter() - started
+
+    def get_latency(self, response, started):
+        if response.status_code != 200:
+            raise CommandError(f'Ответ {response.status_code}')
+        return time.perf_counter() - started
+
+    def report(self, mode, result):
+        latencies, elapsed = result
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'  {mode:>5}: {len(latencies) / elapsed:8.1f} запросов/с, '
+            f'p50 {statistics.median(latencies) * 1000:.1f} мс, '
+            f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс'
+        )
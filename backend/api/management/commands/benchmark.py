@@ -0,0 +1,292 @@
+import itertools
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from app.images import get_rendition_paths
+from app.models import Ingredient, Recipe, Tag
+from users.models import User
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmark_baseline.json'
+PERCENTILES = (50, 90, 95, 99)
+# 1x1 PNG для создания рецептов
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+    'AAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+# Имя, метод, адрес (подстановки из get_context), от пользователя
+SCENARIOS = (
+    ('recipes-anonymous', 'get', '/api/recipes/', False),
+    ('recipes-authenticated', 'get', '/api/recipes/', True),
+    ('recipes-tags', 'get', '/api/recipes/?tags={tag}', True),
+    ('recipes-favorited', 'get', '/api/recipes/?is_favorited=1', True),
+    ('recipe-detail', 'get', '/api/recipes/{recipe}/', True),
+    ('subscriptions', 'get',
+     '/api/users/subscriptions/?recipes_limit=3', True),
+    ('ingredients-search', 'get', '/api/ingredients/?name={name}', False),
+    ('recipe-create', 'post', '/api/recipes/', True),
+    ('recipe-update', 'patch', '/api/recipes/{own_recipe}/', True),
+    ('download-shopping-cart', 'get',
+     '/api/recipes/download_shopping_cart/', True),
+)
+
+
+def percentile(values, percent):
+    """Ближайший ранг по отсортированным значениям"""
+    index = max(round(len(values) * percent / 100) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер горячих адресов API на текущей базе (SQLite или локальный '
+        'PostgreSQL): задержка, запросы к БД, пропускная способность и '
+        'сравнение с сохраненным замером'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='Запросов на сценарий'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Запросов для разогрева, в замер не входят'
+        )
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            choices=[scenario[0] for scenario in SCENARIOS],
+            help='Только указанные сценарии (можно несколько раз)'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='Пользователь (id); по умолчанию - с наибольшим числом '
+                 'подписок'
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом'
+        )
+        parser.add_argument(
+            '--baseline', default=DEFAULT_BASELINE,
+            help='Файл сохраненного замера'
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Сохранить результаты как новый замер для сравнения'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Допустимый рост p95, %%'
+        )
+
+    def handle(self, *args, **options):
+        self.requests = options['requests']
+        self.warmup = options['warmup']
+        self.cold = options['cold']
+        self.user = self.get_user(options['user'])
+        self.created = []
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.clients = {
+            False: Client(),
+            True: Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+        }
+        baseline = self.load_baseline(options['baseline'])
+        meta = self.get_meta()
+        if baseline and baseline['meta'] != meta:
+            self.stdout.write(self.style.WARNING(
+                f'Замер сделан на других данных: {baseline["meta"]}'
+            ))
+        selected = options['scenarios']
+        results = {}
+        try:
+            self.context = self.get_context()
+            for name, method, url, auth in SCENARIOS:
+                if selected and name not in selected:
+                    continue
+                results[name] = self.run(
+                    name, method, url.format(**self.context), auth
+                )
+                self.report(name, results[name], baseline)
+        finally:
+            self.cleanup()
+
+        if options['save']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'meta': meta, 'results': results}, file, indent=2
+                )
+            self.stdout.write(f'Замер сохранен в {options["baseline"]}')
+        regressions = self.get_regressions(
+            results, baseline, options['threshold']
+        )
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно замера: ' + ', '.join(regressions)
+            )
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            return User.objects.get(pk=user_id)
+        user = User.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows', 'pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей: загрузите данные')
+        return user
+
+    def get_meta(self):
+        return {
+            'vendor': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': User.objects.count(),
+            'ingredients': Ingredient.objects.count(),
+        }
+
+    def get_context(self):
+        """Данные для запросов: тег, рецепт, ингредиенты, свой рецепт"""
+        tags = list(Tag.objects.values_list('pk', 'slug')[:2])
+        ingredients = list(
+            Ingredient.objects.values_list('pk', 'name')[:10]
+        )
+        recipe = Recipe.objects.values_list('pk', flat=True).first()
+        if not tags or not ingredients or recipe is None:
+            raise CommandError('Нужны теги, ингредиенты и рецепты')
+        self.names = itertools.count()
+        self.recipe_data = {
+            'text': 'Рецепт для замера', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [pk for pk, _ in tags],
+            'ingredients': [
+                {'id': pk, 'amount': 100} for pk, _ in ingredients
+            ],
+        }
+        own_recipe = self.create_recipe()
+        return {
+            'tag': tags[0][1], 'recipe': recipe,
+            'name': ingredients[0][1][:2], 'own_recipe': own_recipe,
+        }
+
+    def create_recipe(self):
+        response = self.clients[True].post(
+            '/api/recipes/', self.get_recipe_data(),
+            content_type='application/json'
+        )
+        self.check_response('recipe-create', response)
+        self.created.append(response.json()['id'])
+        return self.created[-1]
+
+    def get_recipe_data(self, method='post'):
+        # Название рецепта уникально для автора
+        data = {'name': f'Замер {next(self.names)}', **self.recipe_data}
+        if method == 'patch':
+            # Старые изображения при замене не удаляются
+            del data['image']
+        return data
+
+    def request(self, name, method, url, auth):
+        if self.cold:
+            cache.clear()
+        client = self.clients[auth]
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'get':
+                response = client.get(url)
+            else:
+                response = getattr(client, method)(
+                    url, self.get_recipe_data(method),
+                    content_type='application/json'
+                )
+            if response.streaming:
+                b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        # Как обработчик WSGI после ответа
+        close_old_connections()
+        self.check_response(name, response)
+        if method == 'post':
+            self.created.append(response.json()['id'])
+        return elapsed, len(queries)
+
+    def run(self, name, method, url, auth):
+        for _ in range(self.warmup):
+            self.request(name, method, url, auth)
+        started = time.perf_counter()
+        samples = [
+            self.request(name, method, url, auth)
+            for _ in range(self.requests)
+        ]
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        result = {
+            f'p{percent}': round(percentile(latencies, percent), 2)
+            for percent in PERCENTILES
+        }
+        result.update(
+            mean=round(statistics.mean(latencies), 2),
+            queries=round(statistics.mean(count for _, count in samples), 2),
+            throughput=round(len(samples) / elapsed, 1),
+        )
+        return result
+
+    def check_response(self, name, response):
+        if response.status_code >= 300:
+            raise CommandError(
+                f'{name}: ответ {response.status_code} '
+                f'{response.content[:200].decode(errors="replace")}'
+            )
+
+    def report(self, name, result, baseline):
+        line = (
+            f'{name:<24} p50 {result["p50"]:7.1f} мс  '
+            f'p95 {result["p95"]:7.1f} мс  p99 {result["p99"]:7.1f} мс  '
+            f'запросов {result["queries"]:5.1f}  '
+            f'{result["throughput"]:7.1f} /с'
+        )
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            change = (result['p95'] / previous['p95'] - 1) * 100
+            line += (
+                f'  p95 {change:+.0f}%, запросов '
+                f'{result["queries"] - previous["queries"]:+.1f}'
+            )
+        self.stdout.write(line)
+
+    def get_regressions(self, results, baseline, threshold):
+        if not baseline:
+            return []
+        regressions = []
+        for name, result in results.items():
+            previous = baseline['results'].get(name)
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(f'{name} (запросы к БД)')
+            elif result['p95'] > previous['p95'] * (1 + threshold / 100):
+                regressions.append(f'{name} (p95)')
+        return regressions
+
+    def load_baseline(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def cleanup(self):
+        """Удалить рецепты, созданные замером, вместе с изображениями"""
+        for recipe in Recipe.objects.filter(pk__in=self.created):
+            paths = [recipe.image.name, *get_rendition_paths(
+                recipe.image_renditions
+            )]
+            recipe.delete()
+            for path in filter(None, paths):
+                default_storage.delete(path)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from .budgets import check_query_budget, get_query_budget
+from .instrumentation import RequestStats, current_stats, record_endpoint
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware:
+    """Запросы к БД и время ответа по представлениям.
+
+    Считает запросы к БД, время в БД, рендер ответа и остальную работу
+    представления (в том числе сериализацию). В режиме DEBUG замеры
+    отдаются в заголовках X-Query-Count и Server-Timing, всегда -
+    в статистику процесса (GET /api/metrics/requests/). Должен стоять
+    первым в MIDDLEWARE, чтобы учитывать работу остальных.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Под ASGI цепочка остается асинхронной: синхронный middleware
+        # занял бы общий поток на все время запроса
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_template_response = (
+                self.aprocess_template_response
+            )
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        stats.total_time = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        endpoint = f'{request.method} {match.view_name}'
+        budget = get_query_budget(match.func, request.method)
+        record_endpoint(endpoint, stats, budget)
+        if settings.DEBUG:
+            self.add_headers(response, stats, budget)
+        if budget is not None and stats.queries > budget:
+            if settings.QUERY_BUDGET_STRICT:
+                check_query_budget(endpoint, stats.queries, budget)
+            logger.warning(
+                '%s: %s запросов к БД при бюджете %s',
+                endpoint, stats.queries, budget
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается последним перед рендером ответа
+        return self.track_render(response)
+
+    async def aprocess_template_response(self, request, response):
+        # Под ASGI синхронный метод выполнялся бы в общем потоке
+        return self.track_render(response)
+
+    def track_render(self, response):
+        stats = current_stats.get()
+        if stats is None or response.is_rendered:
+            return response
+        started = time.perf_counter()
+
+        def finish_render(response):
+            stats.render_time += time.perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+    def add_headers(self, response, stats, budget):
+        response['X-Query-Count'] = stats.queries
+        if budget is not None:
+            response['X-Query-Budget'] = budget
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={value * 1000:.1f}' for name, value in (
+                ('db', stats.db_time), ('render', stats.render_time),
+                ('app', stats.app_time), ('total', stats.total_time),
+            )
+        )
@@ -0,0 +1,96 @@
+from collections import defaultdict
+
+from app.models import Recipe, RecipeIngredient
+
+from .utils import get_media_url, get_rendition_urls, get_subscriptions
+
+# Поля рецепта и автора, которые читаются одним запросом
+RECIPE_FIELDS = (
+    'id', 'name', 'text', 'cooking_time', 'image', 'image_renditions',
+    'author_id', 'author__email', 'author__username', 'author__first_name',
+    'author__last_name',
+)
+# Аннотации RecipesView.get_queryset, зависящие от пользователя
+VIEWER_FLAGS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def recipe_values(queryset):
+    """Строки рецептов для serialize_recipes вместо объектов моделей"""
+    flags = [
+        name for name in VIEWER_FLAGS if name in queryset.query.annotations
+    ]
+    return queryset.values(*RECIPE_FIELDS, *flags)
+
+
+def get_recipe_tags(recipe_ids):
+    tags = defaultdict(list)
+    rows = (
+        Recipe.tags.through.objects
+        .filter(recipe_id__in=recipe_ids)
+        .order_by('tag__name')
+        .values_list('recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                     'tag__slug')
+    )
+    for recipe_id, pk, name, color, slug in rows:
+        tags[recipe_id].append(
+            {'id': pk, 'name': name, 'color': color, 'slug': slug}
+        )
+    return tags
+
+
+def get_recipe_ingredients(recipe_ids):
+    ingredients = defaultdict(list)
+    rows = (
+        RecipeIngredient.objects
+        .filter(recipe_id__in=recipe_ids)
+        .order_by('pk')
+        .values_list('recipe_id', 'ingredient_id', 'ingredient__name',
+                     'ingredient__measurement_unit', 'amount')
+    )
+    for recipe_id, pk, name, unit, amount in rows:
+        ingredients[recipe_id].append({
+            'id': pk, 'name': name, 'measurement_unit': unit,
+            'amount': amount,
+        })
+    return ingredients
+
+
+def serialize_recipes(rows, request, subscriptions=None):
+    """Рецепты в том же виде, что и RecipeGETSerializer.
+
+    Вместо объектов моделей и вложенных сериализаторов используются
+    строки recipe_values() и два запроса за тегами и ингредиентами всей
+    страницы. subscriptions - id авторов, на которых подписан
+    пользователь; если не переданы, читаются одним запросом.
+    """
+    rows = list(rows)
+    recipe_ids = [row['id'] for row in rows]
+    if subscriptions is None:
+        subscriptions = get_subscriptions(
+            request.user, [row['author_id'] for row in rows]
+        )
+    tags = get_recipe_tags(recipe_ids)
+    ingredients = get_recipe_ingredients(recipe_ids)
+
+    return [{
+        'id': row['id'],
+        'author': {
+            'id': row['author_id'],
+            'email': row['author__email'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': row['author_id'] in subscriptions,
+        },
+        'name': row['name'],
+        'text': row['text'],
+        'cooking_time': row['cooking_time'],
+        'image': (
+            get_media_url(request, row['image']) if row['image'] else None
+        ),
+        'renditions': get_rendition_urls(request, row['image_renditions']),
+        'tags': tags[row['id']],
+        'ingredients': ingredients[row['id']],
+        'is_favorited': bool(row.get('is_favorited', False)),
+        'is_in_shopping_cart': bool(row.get('is_in_shopping_cart', False)),
+    } for row in rows]
@@ -0,0 +1,47 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON через orjson, если он установлен.
+
+    Результат совпадает с JSONRenderer побайтно: компактные разделители,
+    символы без экранирования, кроме U+2028 и U+2029. Для отступов,
+    ensure_ascii и отсутствия orjson используется обычный JSONRenderer.
+    """
+    encoder = encoders.JSONEncoder()
+
+    def default(self, obj):
+        # Подклассы (OrderedDict, ReturnList, SafeString) приводятся
+        # к базовым типам: orjson не видит порядок после move_to_end
+        if isinstance(obj, dict):
+            return dict(obj)
+        if isinstance(obj, list):
+            return list(obj)
+        if isinstance(obj, str):
+            # Срез подкласса str - обычная строка, str() вернул бы
+            # SafeString
+            return obj[:]
+        if isinstance(obj, int):
+            return int(obj)
+        return self.encoder.default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        # Как и JSONRenderer, экранируем разделители строк для JavaScript
+        return orjson.dumps(
+            data, default=self.default,
+            option=orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_NON_STR_KEYS
+        ).replace(
+            b'\xe2\x80\xa8', b'\\u2028'
+        ).replace(b'\xe2\x80\xa9', b'\\u2029')
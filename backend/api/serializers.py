@@ -1,36 +1,62 @@
-import base64
+import binascii
 
-from django.core.files.base import ContentFile
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from PIL import Image
 from rest_framework import serializers
 
-from app.models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                        ShoppingCart, Tag)
+from app.images import (decode_base64, normalize_upload,
+                        schedule_recipe_renditions)
+from app.models import Ingredient, Recipe, RecipeIngredient, Tag
+from app.shopping_list import recipe_ingredients_changed
+from jobs.models import Job
 from users.models import Follow, User
 
+from .utils import get_recipe_previews, get_recipes_limit, get_rendition_urls
+
 
 class Base64ImageField(serializers.ImageField):
-    """Декодирование картинки"""
+    """Декодирование картинки.
+
+    Картинка декодируется по частям, поворачивается по EXIF, уменьшается
+    и сохраняется без метаданных: PNG и WebP - в своем формате, остальные
+    форматы - в JPEG.
+    """
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            imgstr = data.split(';base64,')[-1]
+            try:
+                data = normalize_upload(decode_base64(imgstr), name='temp')
+            except (binascii.Error, ValueError, OSError,
+                    Image.DecompressionBombError):
+                self.fail('invalid_image')
         return super().to_internal_value(data)
 
 
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные варианты изображения"""
+
+    def to_representation(self, value):
+        return get_rendition_urls(self.context.get('request'), value)
+
+
 class CustomUserSerializer(UserSerializer):
     """Сериализатор для пользователей Djoiser"""
     is_subscribed = serializers.SerializerMethodField(default=True)
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
-        if user.is_anonymous:
+        # На себя подписаться нельзя (FollowCheckSubscribeSerializer)
+        if user.is_anonymous or obj.pk == user.pk:
             return False
 
+        # Подписки на всех авторов страницы собираются представлением
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is not None:
+            return obj.pk in subscriptions
         return user.follower.filter(following=obj.id).exists()
 
     class Meta:
@@ -84,14 +110,30 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+# Максимум рецептов в одном пакетном запросе
+BATCH_MAX_RECIPES = 100
+
+INGREDIENT_REQUIRED_MESSAGE = (
+    'Обязательно нужно указать id ингредиента и его количество'
+)
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
+    # Существование ингредиентов проверяется в RecipeSerializer.validate
+    # одним запросом для всего рецепта
+    id = serializers.IntegerField(
+        error_messages={'required': INGREDIENT_REQUIRED_MESSAGE}
     )
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
+        extra_kwargs = {
+            'amount': {
+                'required': True,
+                'error_messages': {'required': INGREDIENT_REQUIRED_MESSAGE}
+            }
+        }
 
 
 class RecipeIngredientGETSerializer(serializers.ModelSerializer):
@@ -115,6 +157,7 @@ class RecipeGETSerializer(serializers.ModelSerializer):
     )
     tags = TagSerializer(many=True)
     image = Base64ImageField(required=False, allow_null=False)
+    renditions = ImageRenditionsField(source='image_renditions')
     ingredients = RecipeIngredientGETSerializer(
         many=True, read_only=True, source='recipe_ingredient'
     )
@@ -124,8 +167,8 @@ class RecipeGETSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'name', 'text',
-                  'cooking_time', 'image', 'tags', 'ingredients',
-                  'is_favorited', 'is_in_shopping_cart')
+                  'cooking_time', 'image', 'renditions', 'tags',
+                  'ingredients', 'is_favorited', 'is_in_shopping_cart')
         read_only_fields = ('author',)
 
 
@@ -136,76 +179,146 @@ class RecipeSerializer(serializers.ModelSerializer):
         write_only=True, queryset=User.objects.all()
     )
     image = Base64ImageField(required=False, allow_null=False)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = RecipeIngredientSerializer(
         many=True, source='recipe_ingredient'
     )
 
+    def validate_tags(self, value):
+        tags = Tag.objects.in_bulk(value)
+        missing = [pk for pk in value if pk not in tags]
+        if missing:
+            raise serializers.ValidationError(
+                f'Теги не найдены: {", ".join(map(str, missing))}'
+            )
+        return [tags[pk] for pk in dict.fromkeys(value)]
+
     def validate(self, data):
-        ingredients = self.initial_data['ingredients']
+        ingredients = data.get('recipe_ingredient')
+        if ingredients is None and self.partial:
+            return data
 
         if not ingredients:
             raise serializers.ValidationError(
                 'Минимально должен быть 1 ингредиент.'
             )
 
-        ingredient_list = []
-        for item in ingredients:
-            # Проверка на то, что поля отсутствуют в POST/PATCH запросах
-            if not item.get('id') or not item.get('amount'):
-                raise serializers.ValidationError(
-                    'Обязательно нужно указать id ингредиента и его количество'
-                )
-
-            # Проверка на случай если поступают некорректный id ингредиента
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
-
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиент не должен повторяться.'
-                )
+        ingredient_ids = [item['id'] for item in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'Ингредиент не должен повторяться.'
+            )
 
-            ingredient_list.append(ingredient)
+        # Все id ингредиентов проверяются одним запросом
+        existing = set(Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).values_list('id', flat=True))
+        missing = [pk for pk in ingredient_ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError({
+                'ingredients': 'Ингредиенты не найдены: '
+                               + ', '.join(map(str, missing))
+            })
 
         return data
 
-    @transaction.atomic()
     def update(self, instance, validated_data):
-        instance.ingredients.clear()
-        instance.tags.clear()
-
-        ingredients_data = validated_data.pop('recipe_ingredient')
-        instance.tags.set(validated_data.get('tags', instance.tags))
+        ingredients_data = validated_data.pop('recipe_ingredient', None)
+        tags_data = validated_data.pop('tags', None)
+
+        # Транзакцию открывает RecipesView.update, рецепт заблокирован
+        # еще при чтении, до чтения состава: см. app.locks.lock_recipes
+        if tags_data is not None:
+            self.update_tags(instance, tags_data)
+        if ingredients_data is not None:
+            self.update_ingredients(instance, {
+                ingredient.get('id'): ingredient.get('amount')
+                for ingredient in ingredients_data
+            })
+
+        if 'image' in validated_data:
+            instance.image = validated_data.pop('image')
+            schedule_recipe_renditions(instance)
+        return super().update(instance, validated_data)
 
-        RecipeIngredient.objects.bulk_create([
-            RecipeIngredient(
-                recipe=instance,
-                ingredient_id=ingredient.get('id').pk,
-                amount=ingredient.get('amount')
-            ) for ingredient in ingredients_data
+    def update_tags(self, recipe, tags, created=False):
+        """Изменить теги рецепта, затрагивая только изменившиеся строки.
+
+        Строки связи меняются напрямую, без m2m_changed: версии данных
+        рецепта меняет его сохранение (app/signals.py).
+        """
+        through = Recipe.tags.through
+        current = set() if created else set(through.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', flat=True))
+        tag_ids = [tag.pk for tag in tags]
+        removed = current.difference(tag_ids)
+        if removed:
+            through.objects.filter(
+                recipe=recipe, tag_id__in=removed
+            ).delete()
+        through.objects.bulk_create([
+            through(recipe=recipe, tag_id=pk)
+            for pk in tag_ids if pk not in current
         ])
 
-        return super().update(instance, validated_data)
+    def update_ingredients(self, recipe, amounts):
+        """Изменить состав рецепта, затрагивая только изменившиеся строки"""
+        current = {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: row.amount for pk, row in current.items()}
+
+        removed = [row.pk for pk, row in current.items() if pk not in amounts]
+        changed = []
+        added = []
+        for pk, amount in amounts.items():
+            row = current.get(pk)
+            if row is None:
+                added.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=pk, amount=amount
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+
+        # Одним DELETE без сигналов на каждую строку: версии данных
+        # рецепта меняет его сохранение
+        if removed:
+            rows = RecipeIngredient.objects.filter(pk__in=removed)
+            rows._raw_delete(rows.db)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        recipe_ingredients_changed(recipe, old_amounts, amounts)
 
     @transaction.atomic()
     def create(self, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredient')
         tags_data = validated_data.pop('tags')
 
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags_data)
+        recipe = Recipe(**validated_data)
+        schedule_recipe_renditions(recipe)
+        recipe.save()
+        self.update_tags(recipe, tags_data, created=True)
 
-        for ingredient in ingredients_data:
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient.get('id'),
+                ingredient_id=ingredient.get('id'),
                 amount=ingredient.get('amount')
-            )
+            ) for ingredient in ingredients_data
+        ])
 
         return recipe
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], 'tags', Prefetch(
+            'recipe_ingredient',
+            RecipeIngredient.objects.select_related('ingredient')
+        ))
         return RecipeGETSerializer(
             instance, context={'request': self.context.get('request')}
         ).data
@@ -226,10 +339,11 @@ class RecipeSerializer(serializers.ModelSerializer):
 class RecipeSerializerShort(serializers.ModelSerializer):
     """Сериализатор для рецептов (укороченный)"""
     image = Base64ImageField(required=False, allow_null=False)
+    renditions = ImageRenditionsField(source='image_renditions')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'renditions', 'cooking_time')
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -245,22 +359,22 @@ class FollowSerializer(serializers.ModelSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = obj.following.recipes.all()
-        if limit:
-            queryset = queryset[:int(limit)]
+        previews = self.context.get('recipes')
+        if previews is None:
+            previews = get_recipe_previews(
+                [obj.following_id], get_recipes_limit(request)
+            )
         return RecipeSerializerShort(
-            queryset, many=True, context={'request': request}
+            previews[obj.following_id], many=True,
+            context={'request': request}
         ).data
 
     def get_recipes_count(self, obj):
-        return obj.following.recipes.all().count()
+        return obj.following.recipes_count
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.follower.filter(following=obj.id).exists()
+        # Подписка сериализуется только для ее владельца
+        return obj.follower_id == self.context.get('request').user.pk
 
     class Meta:
         fields = ('id', 'email', 'username', 'first_name', 'last_name',
@@ -268,16 +382,16 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
 
 
-class FollowCheckSubscribeSerializer(serializers.ModelSerializer):
-    """Сериализатор для проверки подписки"""
+class FollowCheckSubscribeSerializer(serializers.Serializer):
+    """Сериализатор для проверки подписки.
 
-    class Meta:
-        model = Follow
-        fields = ('follower', 'following')
+    Пользователь - из запроса, автор - из контекста (author): оба уже
+    загружены представлением.
+    """
 
     def validate(self, obj):
-        user = obj['follower']
-        author = obj['following']
+        user = self.context['request'].user
+        author = self.context['author']
         is_subscribed = user.follower.filter(following=author).exists()
 
         if self.context.get('request').method == 'POST':
@@ -303,66 +417,23 @@ class FollowCheckSubscribeSerializer(serializers.ModelSerializer):
         return obj
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
-    user = serializers.SlugRelatedField(
-        slug_field='username', default=serializers.CurrentUserDefault(),
-        read_only=True
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_RECIPES,
     )
-    recipe = serializers.PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all()
-    )
-
-    def validate(self, obj):
-        user = self.context.get('request').user
-        recipe = obj['recipe']
-        favorite = user.favorites.filter(recipe=recipe).exists()
-
-        if self.context.get('request').method == 'POST' and favorite:
-            raise serializers.ValidationError(
-                'Этот рецепт уже есть в избранном'
-            )
-        if self.context.get('request').method == 'DELETE' and not favorite:
-            raise serializers.ValidationError(
-                'Этого рецепта нет в избранном'
-            )
-
-        return obj
 
-    class Meta:
-        model = FavoriteRecipe
-        fields = ('user', 'recipe',)
+    def validate_recipes(self, value):
+        # Повторы убираются с сохранением порядка
+        return list(dict.fromkeys(value))
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all()
-    )
-    recipe = serializers.PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all()
-    )
-
-    def validate(self, obj):
-        user = self.context['request'].user
-        recipe = obj['recipe']
-        cart = user.cart.filter(recipe=recipe).exists()
-
-        if self.context.get('request').method == 'POST' and cart:
-            raise serializers.ValidationError(
-                'Этот рецепт уже добавлен в корзину'
-            )
-        if self.context.get('request').method == 'DELETE' and not cart:
-            raise serializers.ValidationError(
-                'Этот рецепт отсутствует в корзине'
-            )
-        return obj
+class JobSerializer(serializers.ModelSerializer):
+    """Сериализатор для фоновых задач"""
 
     class Meta:
-        model = ShoppingCart
-        fields = ('user', 'recipe')
-        validators = [
-            serializers.UniqueTogetherValidator(
-                queryset=ShoppingCart.objects.all(),
-                fields=['user', 'recipe'],
-                message='Вы уже добавили рецепт в корзину.'
-            )
-        ]
+        model = Job
+        fields = ('id', 'name', 'status', 'attempts', 'result', 'created',
+                  'updated')
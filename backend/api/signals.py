@@ -0,0 +1,45 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+from .authentication import invalidate_tokens
+
+# Поля пользователя, от которых зависит вход по токену и права
+AUTH_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser')
+
+
+def get_auth_data(user):
+    # Без обращения к отложенным полям: они дали бы лишний запрос
+    return tuple(user.__dict__.get(field) for field in AUTH_FIELDS)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_init, sender=User)
+def remember_auth_data(sender, instance, **kwargs):
+    instance._auth_data = get_auth_data(instance)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, raw,
+                           update_fields=None, **kwargs):
+    """Смена пароля, деактивация и изменение прав пользователя.
+
+    Остальные сохранения (last_login при входе, профиль) токены
+    не сбрасывают и не ищут.
+    """
+    if created or raw or (update_fields is not None
+                          and not set(update_fields) & set(AUTH_FIELDS)):
+        return
+    data = get_auth_data(instance)
+    if data == instance._auth_data:
+        return
+    instance._auth_data = data
+    invalidate_tokens(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
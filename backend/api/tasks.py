@@ -0,0 +1,22 @@
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from jobs.queue import task
+
+from .utils import draw_shopping_cart, get_shopping_cart_ingredients
+
+
+@task('shopping_cart_pdf')
+def shopping_cart_pdf(job):
+    """PDF со списком покупок пользователя задачи"""
+    with tempfile.TemporaryFile() as output:
+        draw_shopping_cart(
+            output, get_shopping_cart_ingredients(job.user).iterator()
+        )
+        output.seek(0)
+        path = default_storage.save(
+            f'exports/shopping_cart_{job.user_id}_{job.pk}.pdf', File(output)
+        )
+    return {'file': path}
@@ -0,0 +1,1002 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from app.images import (encode_image, get_rendition_paths, normalize_upload,
+                        prepare_image)
+from app.models import (DataVersion, FavoriteRecipe, FeedEntry, Ingredient,
+                        Recipe, RecipeIngredient, ShoppingCart,
+                        ShoppingListItem, Tag)
+from app.search import ingredient_index
+from app.shopping_list import (calculate_shopping_lists,
+                               get_stored_shopping_lists,
+                               rebuild_shopping_lists)
+from app.versions import get_versions
+from jobs.models import Job
+from jobs.queue import claim_job, run_job
+from users.models import Follow, User
+
+from .authentication import local_cache
+from .budgets import QueryBudgetExceeded, query_budget, strict_query_budgets
+from .instrumentation import get_endpoint_stats, reset_endpoint_stats
+from .readers import recipe_values, serialize_recipes
+from .renderers import FastJSONRenderer
+from .serializers import RecipeGETSerializer
+from .utils import CustomPageNumberPagination, KeysetPagination
+from .views import RecipesView, TagViewSet
+
+# 1x1 PNG
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+    'AAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class FoodgramTestData:
+    """Авторы, теги, ингредиенты и рецепты с избранным, корзинами
+    и подписками"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_test_data()
+
+    @classmethod
+    def create_test_data(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='password'
+        )
+        cls.other_author = User.objects.create_user(
+            username='other', email='other@example.com',
+            first_name='Другой', last_name='Автор', password='password'
+        )
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Читатель', last_name='Рецептов', password='password'
+        )
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#E26C2D', 'breakfast'),
+                ('Обед', '#49B64E', 'lunch'),
+                ('Ужин', '#8775D2', 'dinner'),
+            )
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (
+                ('картофель', 'г'), ('молоко', 'мл'), ('яйца', 'шт'),
+                ('соль', 'по вкусу'),
+            )
+        ]
+        cls.recipes = []
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                author=cls.author if number % 2 else cls.other_author,
+                name=f'Рецепт "{number}"   с кавычками',
+                text=f'Описание рецепта {number}\u2028«шаги»',
+                cooking_time=number + 1,
+                image=f'recipes/recipe_{number}.jpg',
+                image_renditions={} if number % 3 else {
+                    'thumbnail': {
+                        'webp': f'recipes/renditions/{number}_thumbnail.webp',
+                        'jpeg': f'recipes/renditions/{number}_thumbnail.jpg',
+                    },
+                },
+            )
+            recipe.tags.set(cls.tags[:number % 3 + 1])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient,
+                    amount=number * 10 + index + 1
+                )
+                for index, ingredient in enumerate(
+                    cls.ingredients[:number % 4 + 1]
+                )
+            ])
+            cls.recipes.append(recipe)
+        cls.other_viewer = User.objects.create_user(
+            username='other_viewer', email='other_viewer@example.com',
+            first_name='Еще', last_name='Читатель', password='password'
+        )
+        for user in (cls.viewer, cls.other_viewer):
+            for recipe in cls.recipes[::2]:
+                FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            for recipe in cls.recipes[1::3]:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+            Follow.objects.create(follower=user, following=cls.author)
+        # Корзины созданы без представлений: сводные списки собираются здесь
+        rebuild_shopping_lists()
+
+    def setUp(self):
+        # Версии данных, общие страницы и токены не переходят между тестами
+        cache.clear()
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def get_recipe_data(self, **data):
+        return {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in self.ingredients
+            ],
+            **data,
+        }
+
+
+class RecipeSerializationTest(FoodgramTestData, TestCase):
+    """serialize_recipes + FastJSONRenderer против RecipeGETSerializer
+    + JSONRenderer: ответы должны совпадать побайтно"""
+
+    factory = APIRequestFactory()
+
+    def get_request(self, user=None, query=''):
+        request = Request(self.factory.get(f'/api/recipes/{query}'))
+        if user is not None:
+            request.user = user
+        return request
+
+    def get_queryset(self, request):
+        view = RecipesView()
+        view.request = request
+        return view.get_queryset()
+
+    def render_expected(self, data):
+        return JSONRenderer().render(data)
+
+    def render_fast(self, data):
+        return FastJSONRenderer().render(data)
+
+    def assert_recipes_match(self, user=None):
+        request = self.get_request(user)
+        queryset = self.get_queryset(request)
+        expected = RecipeGETSerializer(
+            queryset, many=True, context={'request': request}
+        ).data
+        actual = serialize_recipes(recipe_values(queryset), request)
+        self.assertEqual(
+            self.render_fast(actual), self.render_expected(expected)
+        )
+
+    def test_anonymous(self):
+        self.assert_recipes_match()
+
+    def test_authenticated(self):
+        self.assert_recipes_match(self.viewer)
+
+    def test_author(self):
+        self.assert_recipes_match(self.author)
+
+    def test_viewer_flags_present(self):
+        """Проверка самих данных: флаги, теги и ингредиенты на месте"""
+        request = self.get_request(self.viewer)
+        rows = serialize_recipes(
+            recipe_values(self.get_queryset(request)), request
+        )
+        by_id = {row['id']: row for row in rows}
+        favorite, in_cart = self.recipes[0], self.recipes[1]
+        self.assertTrue(by_id[favorite.pk]['is_favorited'])
+        self.assertTrue(by_id[in_cart.pk]['is_in_shopping_cart'])
+        self.assertTrue(by_id[in_cart.pk]['author']['is_subscribed'])
+        self.assertEqual(len(by_id[self.recipes[2].pk]['tags']), 3)
+        self.assertEqual(len(by_id[self.recipes[3].pk]['ingredients']), 4)
+
+    def assert_keyset_match(self, user, query):
+        request = self.get_request(user, query)
+        queryset = self.get_queryset(request)
+
+        expected_paginator = KeysetPagination()
+        page = expected_paginator.paginate_queryset(queryset, request)
+        expected = expected_paginator.get_paginated_response(
+            RecipeGETSerializer(
+                page, many=True, context={'request': request}
+            ).data
+        ).data
+
+        paginator = KeysetPagination()
+        rows = paginator.paginate_queryset(recipe_values(queryset), request)
+        actual = paginator.get_paginated_response(
+            serialize_recipes(rows, request)
+        ).data
+        self.assertEqual(
+            self.render_fast(actual), self.render_expected(expected)
+        )
+        return actual
+
+    def test_keyset_with_count(self):
+        for user in (None, self.viewer):
+            with self.subTest(user=user):
+                data = self.assert_keyset_match(
+                    user, '?cursor=&limit=3&with_count=1'
+                )
+                self.assertEqual(list(data)[0], 'count')
+                self.assertEqual(data['count'], len(self.recipes))
+
+    def test_keyset_without_count(self):
+        data = self.assert_keyset_match(self.viewer, '?cursor=&limit=3')
+        self.assertNotIn('count', data)
+
+    def test_list_endpoint(self):
+        """Ответ списка (общий кэш + флаги пользователя) как у
+        сериализатора с постраничным выводом"""
+        for user in (None, self.viewer):
+            with self.subTest(user=user):
+                for _ in range(2):
+                    # Второй запрос - из общего кэша страниц
+                    response = self.get_client(user).get(
+                        '/api/recipes/?limit=5&page=1'
+                    )
+                    request = self.get_request(user, '?limit=5&page=1')
+                    paginator = CustomPageNumberPagination()
+                    page = paginator.paginate_queryset(
+                        self.get_queryset(request), request
+                    )
+                    expected = paginator.get_paginated_response(
+                        RecipeGETSerializer(
+                            page, many=True, context={'request': request}
+                        ).data
+                    ).data
+                    self.assertEqual(
+                        response.content, self.render_expected(expected)
+                    )
+
+    def test_detail_endpoint(self):
+        recipe = self.recipes[1]
+        for user in (None, self.viewer):
+            with self.subTest(user=user):
+                response = self.get_client(user).get(
+                    f'/api/recipes/{recipe.pk}/'
+                )
+                request = self.get_request(user)
+                expected = RecipeGETSerializer(
+                    self.get_queryset(request).get(pk=recipe.pk),
+                    context={'request': request}
+                ).data
+                self.assertEqual(
+                    response.content, self.render_expected(expected)
+                )
+
+
+class ConditionalGetTest(FoodgramTestData, TestCase):
+    """ETag по версиям данных и смена версий при изменениях"""
+
+    def test_etag(self):
+        client = self.get_client(self.viewer)
+        response = client.get('/api/tags/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        response = client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tags[0].name = 'Полдник'
+            self.tags[0].save()
+        response = client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_users_version(self):
+        """Версию users меняют только поля автора в данных рецептов"""
+        version = get_versions('users')['users']
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.get(pk=self.author.pk)
+            user.set_password('new-password')
+            user.save()
+            user.save(update_fields=['last_login'])
+            User.objects.create_user(username='new', email='new@example.com')
+        self.assertEqual(get_versions('users')['users'], version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.first_name = 'Шеф'
+            user.save()
+        self.assertGreater(get_versions('users')['users'], version)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='foodgram-tests-'))
+class CounterTest(FoodgramTestData, TestCase):
+    """Счетчики favorites_count и recipes_count совпадают с числом строк
+    после одиночных и пакетных изменений и после recount"""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def assert_counters_match(self):
+        self.assertEqual(
+            dict(Recipe.objects.values_list('pk', 'favorites_count')),
+            {recipe.pk: recipe.favorites.count()
+             for recipe in Recipe.objects.all()}
+        )
+        self.assertEqual(
+            dict(User.objects.values_list('pk', 'recipes_count')),
+            {user.pk: user.recipes.count() for user in User.objects.all()}
+        )
+
+    def test_recipe_create_and_delete(self):
+        client = self.get_client(self.author)
+        response = client.post(
+            '/api/recipes/', self.get_recipe_data(), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 5
+        )
+        self.assert_counters_match()
+        response = client.delete(f'/api/recipes/{self.recipes[1].pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).recipes_count, 4
+        )
+        self.assert_counters_match()
+
+    def test_favorite(self):
+        client = self.get_client(self.viewer)
+        url = f'/api/recipes/{self.recipes[1].pk}/favorite/'
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assertEqual(client.post(url).status_code, 400)
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[1].pk).favorites_count, 1
+        )
+        self.assert_counters_match()
+        self.assertEqual(client.delete(url).status_code, 204)
+        self.assertEqual(client.delete(url).status_code, 400)
+        self.assert_counters_match()
+
+    def test_batch(self):
+        client = self.get_client(self.viewer)
+        # Половина рецептов уже в избранном, id повторяются
+        data = {'recipes': [recipe.pk for recipe in self.recipes] * 2}
+        for method in ('post', 'post', 'delete', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(client, method)(
+                    '/api/recipes/favorite/batch/', data, format='json'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assert_counters_match()
+
+    def test_recount(self):
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(
+            favorites_count=10
+        )
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        out = StringIO()
+        call_command('recount', batch_size=2, stdout=out)
+        self.assertIn('рецептов - 1, пользователей - 1', out.getvalue())
+        self.assert_counters_match()
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(prefix='foodgram-tests-'),
+    IMAGE_RENDITIONS_IN_BACKGROUND=False
+)
+class RecipeImageTest(FoodgramTestData, TestCase):
+    """Варианты изображения пишутся тем же сохранением рецепта, файлы
+    прежних вариантов удаляются после фиксации"""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def get_paths(self, pk):
+        paths = get_rendition_paths(Recipe.objects.get(pk=pk).image_renditions)
+        self.assertTrue(paths)
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        return paths
+
+    def test_create_and_update(self):
+        client = self.get_client(self.author)
+        response = client.post(
+            '/api/recipes/', self.get_recipe_data(), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(response.data['renditions'])
+        pk = response.data['id']
+        paths = self.get_paths(pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/recipes/{pk}/', {'image': IMAGE}, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        new_paths = self.get_paths(pk)
+        self.assertFalse(paths & new_paths)
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+
+class BatchTest(FoodgramTestData, TestCase):
+    """Пакетные изменения: статус по каждому id и ошибки запроса"""
+
+    def request(self, method, relation, recipe_ids, status=200):
+        response = getattr(self.get_client(self.viewer), method)(
+            f'/api/recipes/{relation}/batch/', {'recipes': recipe_ids},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def get_statuses(self, method, relation, recipe_ids):
+        return [
+            (result['id'], result['status']) for result
+            in self.request(method, relation, recipe_ids)['results']
+        ]
+
+    def test_results(self):
+        # recipes[0] в избранном и не в корзине, recipes[1] - наоборот
+        first, second = self.recipes[0].pk, self.recipes[1].pk
+        missing = 10 ** 6
+        recipe_ids = [second, missing, first, second]
+        for relation, added, removed in (
+            ('favorite',
+             [(second, 'created'), (missing, 'not_found'),
+              (first, 'exists')],
+             [(second, 'deleted'), (missing, 'not_found'),
+              (first, 'deleted')]),
+            ('shopping_cart',
+             [(second, 'exists'), (missing, 'not_found'),
+              (first, 'created')],
+             [(second, 'deleted'), (missing, 'not_found'),
+              (first, 'deleted')]),
+        ):
+            with self.subTest(relation=relation):
+                self.assertEqual(
+                    self.get_statuses('post', relation, recipe_ids), added
+                )
+                self.assertEqual(
+                    self.get_statuses('delete', relation, recipe_ids),
+                    removed
+                )
+                self.assertEqual(
+                    self.get_statuses('delete', relation, [first]),
+                    [(first, 'absent')]
+                )
+
+    def test_errors(self):
+        too_many = list(range(1, 102))
+        for recipe_ids in (None, [], ['one'], [0], too_many):
+            with self.subTest(recipe_ids=recipe_ids):
+                data = self.request('post', 'favorite', recipe_ids, 400)
+                self.assertIn('recipes', data)
+        response = self.get_client().post(
+            '/api/recipes/favorite/batch/', {'recipes': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(FavoriteRecipe.objects.filter(
+            user=self.viewer, recipe__in=self.recipes[1::2]
+        ).exists())
+
+
+class TokenCacheTest(FoodgramTestData, TestCase):
+    """Кэш токенов сбрасывается сменой пароля и деактивацией"""
+
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+        self.user = User.objects.get(pk=self.viewer.pk)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def assert_token_cached(self, cached):
+        self.assertEqual(
+            local_cache.get(f'auth-token:{self.token.key}') is not None,
+            cached
+        )
+
+    def test_password_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new-password')
+            self.user.save()
+        self.assert_token_cached(False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_deactivation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+        self.assert_token_cached(False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_other_changes(self):
+        """Вход и правка профиля не ищут токены и не сбрасывают кэш"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                self.user.save(update_fields=['last_login'])
+            self.user.first_name = 'Шеф'
+            self.user.save()
+        self.assert_token_cached(True)
+
+
+class ImageUploadTest(SimpleTestCase):
+    """Оригиналы PNG и WebP сохраняют формат и прозрачность"""
+
+    def get_upload(self, image_format, mode='RGBA'):
+        image = Image.new(mode, (40, 20), (255, 0, 0, 0)[:len(mode)])
+        image.paste((0, 0, 255, 255)[:len(mode)], (0, 0, 20, 20))
+        output = BytesIO()
+        image.save(output, image_format)
+        output.seek(0)
+        return output
+
+    def open_upload(self, image_format, mode='RGBA'):
+        upload = normalize_upload(self.get_upload(image_format, mode))
+        return upload.name, Image.open(upload)
+
+    def test_transparent_formats(self):
+        for image_format, name in (('PNG', 'image.png'),
+                                   ('WEBP', 'image.webp')):
+            with self.subTest(image_format=image_format):
+                upload_name, image = self.open_upload(image_format)
+                self.assertEqual(upload_name, name)
+                self.assertEqual(image.format, image_format)
+                self.assertEqual(image.mode, 'RGBA')
+                self.assertEqual(image.getpixel((30, 10))[3], 0)
+                self.assertEqual(image.getpixel((10, 10))[3], 255)
+
+    def test_other_formats(self):
+        upload_name, image = self.open_upload('GIF', 'P')
+        self.assertEqual((upload_name, image.format), ('image.jpg', 'JPEG'))
+        upload_name, image = self.open_upload('PNG', 'RGB')
+        self.assertEqual((upload_name, image.mode), ('image.png', 'RGB'))
+
+    def test_jpeg_flattens_transparency(self):
+        image = prepare_image(Image.open(self.get_upload('PNG')))
+        jpeg = Image.open(BytesIO(encode_image(image, 'jpeg')))
+        self.assertEqual(jpeg.mode, 'RGB')
+        # Прозрачное - на белом фоне
+        self.assertGreater(min(jpeg.getpixel((35, 10))), 240)
+
+
+class RecipeFilterTest(FoodgramTestData, TestCase):
+    """Фильтр по тегам: любой из тегов или, с tags_match=all, все"""
+
+    def get_recipe_ids(self, query):
+        response = self.get_client().get(f'/api/recipes/?limit=50&{query}')
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.json()['results']}
+
+    def get_expected_ids(self, tag_counts):
+        # У рецепта number первые number % 3 + 1 тегов
+        return {
+            recipe.pk for number, recipe in enumerate(self.recipes)
+            if number % 3 + 1 in tag_counts
+        }
+
+    def test_tags_match(self):
+        query = 'tags=lunch&tags=dinner'
+        self.assertEqual(
+            self.get_recipe_ids(query), self.get_expected_ids({2, 3})
+        )
+        self.assertEqual(
+            self.get_recipe_ids(f'{query}&tags_match=any'),
+            self.get_expected_ids({2, 3})
+        )
+        self.assertEqual(
+            self.get_recipe_ids(f'{query}&tags_match=all'),
+            self.get_expected_ids({3})
+        )
+        self.assertEqual(
+            self.get_recipe_ids('tags=breakfast&tags=lunch&tags_match=all'),
+            self.get_expected_ids({2, 3})
+        )
+        self.assertEqual(
+            self.get_recipe_ids('tags=dinner&tags=unknown&tags_match=all'),
+            set()
+        )
+
+    def test_invalid_tags_match(self):
+        response = self.get_client().get('/api/recipes/?tags_match=some')
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeSearchTest(FoodgramTestData, TestCase):
+    """Поиск рецептов: совпадение в названии выше совпадения в описании"""
+
+    def setUp(self):
+        super().setUp()
+        self.in_name = self.create_recipe('Курица с картофелем', 'Запечь')
+        # Новее, но совпадает только описание
+        self.in_text = self.create_recipe(
+            'Овощной салат', 'Можно добавить курицу'
+        )
+        self.create_recipe('Суп', 'Сварить')
+
+    def create_recipe(self, name, text):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, text=text, cooking_time=5,
+            image='recipes/search.jpg'
+        )
+        recipe.tags.set(self.tags[:1])
+        return recipe.pk
+
+    def get_recipe_ids(self, query):
+        response = self.get_client().get(f'/api/recipes/?limit=50&{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_relevance(self):
+        expected = [self.in_name, self.in_text]
+        self.assertEqual(self.get_recipe_ids('search=курица'), expected)
+        self.assertEqual(self.get_recipe_ids('search=Курицей'), expected)
+        self.assertEqual(
+            self.get_recipe_ids('search=курица запечь'), [self.in_name]
+        )
+        self.assertEqual(self.get_recipe_ids('search=шоколад'), [])
+
+    def test_filters_and_ordering(self):
+        self.assertEqual(
+            self.get_recipe_ids('search=курица&ordering=-id'),
+            [self.in_text, self.in_name]
+        )
+        self.assertEqual(
+            self.get_recipe_ids('search=курица&tags=dinner'), []
+        )
+        self.assertEqual(
+            self.get_recipe_ids('search=курица&tags=breakfast'),
+            [self.in_name, self.in_text]
+        )
+
+
+class IngredientSearchTest(FoodgramTestData, TestCase):
+    """Поиск ингредиентов: совпадения по началу названия, затем
+    по подстроке, не больше INGREDIENT_SEARCH_LIMIT"""
+
+    def setUp(self):
+        super().setUp()
+        for name in ('эскимо', 'Молоко топленое', 'мороженое'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        # Индекс процесса мог остаться от откаченных транзакций
+        ingredient_index.invalidate()
+        self.addCleanup(ingredient_index.invalidate)
+
+    def get_names(self, query):
+        response = self.get_client().get(f'/api/ingredients/?name={query}')
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(
+            self.get_names('Мо'),
+            ['молоко', 'Молоко топленое', 'мороженое', 'эскимо']
+        )
+        self.assertEqual(self.get_names('ло'), ['молоко', 'Молоко топленое'])
+        self.assertEqual(self.get_names('сахар'), [])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(self.get_names('мо'), ['молоко', 'Молоко топленое'])
+
+
+class FeedTest(FoodgramTestData, TestCase):
+    """Лента подписок: рассылка новых рецептов, подписка и отписка"""
+
+    def get_feed_ids(self, user):
+        response = self.get_client(user).get('/api/recipes/feed/?limit=50')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_recipe_ids(self, author):
+        return list(Recipe.objects.filter(
+            author=author
+        ).order_by('-id').values_list('pk', flat=True))
+
+    def test_fan_out(self):
+        """Первая пачка подписчиков - в запросе, остальные - задачей"""
+        with mock.patch('app.feed.FEED_BATCH_SIZE', 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    author=self.author, name='Новый', text='Описание',
+                    cooking_time=5, image='recipes/new.jpg'
+                )
+        self.assertEqual(
+            FeedEntry.objects.filter(recipe=recipe).count(), 1
+        )
+        job = claim_job()
+        self.assertEqual(job.name, 'feed_fan_out')
+        self.assertEqual(run_job(job).status, Job.DONE)
+        for user in (self.viewer, self.other_viewer):
+            with self.subTest(user=user):
+                self.assertEqual(self.get_feed_ids(user)[0], recipe.pk)
+
+    def test_follow_and_unfollow(self):
+        self.assertEqual(
+            self.get_feed_ids(self.viewer), self.get_recipe_ids(self.author)
+        )
+        client = self.get_client(self.viewer)
+        url = f'/api/users/{self.other_author.pk}/subscribe/'
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assertEqual(
+            self.get_feed_ids(self.viewer),
+            sorted(self.get_recipe_ids(self.author)
+                   + self.get_recipe_ids(self.other_author), reverse=True)
+        )
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(client.delete(url).status_code, 200)
+        self.assertEqual(
+            self.get_feed_ids(self.viewer),
+            self.get_recipe_ids(self.other_author)
+        )
+        # Лента другого подписчика не меняется
+        self.assertEqual(
+            self.get_feed_ids(self.other_viewer),
+            self.get_recipe_ids(self.author)
+        )
+
+
+class ShoppingListTest(FoodgramTestData, TestCase):
+    """Сохраненные списки покупок совпадают со списками, посчитанными
+    заново по корзинам, после каждого изменения корзин и рецептов"""
+
+    def assert_shopping_lists_match(self):
+        stored = get_stored_shopping_lists()
+        self.assertTrue(stored)
+        self.assertEqual(stored, calculate_shopping_lists())
+
+    def test_add_and_remove(self):
+        client = self.get_client(self.viewer)
+        url = f'/api/recipes/{self.recipes[3].pk}/shopping_cart/'
+        self.assertEqual(client.post(url).status_code, 201)
+        self.assert_shopping_lists_match()
+        url = f'/api/recipes/{self.recipes[1].pk}/shopping_cart/'
+        self.assertEqual(client.delete(url).status_code, 204)
+        self.assert_shopping_lists_match()
+
+    def test_batch(self):
+        client = self.get_client(self.viewer)
+        data = {'recipes': [recipe.pk for recipe in self.recipes[:4]]}
+        for method in ('post', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(client, method)(
+                    '/api/recipes/shopping_cart/batch/', data, format='json'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assert_shopping_lists_match()
+
+    def test_recipe_update(self):
+        # Рецепт в корзинах обоих читателей: ингредиент убран, другой
+        # изменен и третий добавлен
+        response = self.get_client(self.author).patch(
+            f'/api/recipes/{self.recipes[1].pk}/', {
+                'ingredients': [
+                    {'id': self.ingredients[1].pk, 'amount': 100},
+                    {'id': self.ingredients[2].pk, 'amount': 3},
+                ],
+            }, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assert_shopping_lists_match()
+
+    def test_recipe_delete(self):
+        response = self.get_client(self.author).delete(
+            f'/api/recipes/{self.recipes[7].pk}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_shopping_lists_match()
+
+    def test_rebuild_command(self):
+        ShoppingListItem.objects.filter(user=self.viewer).update(
+            total_amount=1
+        )
+        ShoppingListItem.objects.filter(user=self.other_viewer).delete()
+        out = StringIO()
+        call_command('shoppinglist', batch_size=1, stdout=out)
+        self.assertIn(
+            f'{self.viewer.pk}, {self.other_viewer.pk}', out.getvalue()
+        )
+        self.assertNotEqual(
+            get_stored_shopping_lists(), calculate_shopping_lists()
+        )
+        call_command('shoppinglist', rebuild=True, stdout=out)
+        self.assert_shopping_lists_match()
+
+
+@strict_query_budgets
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='foodgram-tests-'))
+class QueryBudgetTest(FoodgramTestData, TransactionTestCase):
+    """Горячие адреса API укладываются в бюджеты запросов к БД.
+
+    Представления объявляют бюджеты в query_budgets, с
+    strict_query_budgets превышение роняет тест (QueryBudgetExceeded).
+    TransactionTestCase: как и в работе, обработчики on_commit (смена
+    версий данных) выполняются внутри запроса и входят в бюджет. Перед
+    каждым запросом кэш очищается, а строки версий данных, которые
+    в работе давно созданы, создаются заранее: замеряется запрос без
+    готовой страницы и с проверкой токена.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        reset_endpoint_stats()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def warm_versions(self):
+        DataVersion.objects.bulk_create([
+            DataVersion(scope=scope, version=1) for scope in (
+                'recipes', 'tags', 'ingredients', 'users', 'favorites',
+                *(f'viewer:{user.pk}' for user in User.objects.all()),
+                *(f'recipe:{pk}' for pk in Recipe.objects.values_list(
+                    'pk', flat=True
+                ))
+            )
+        ], ignore_conflicts=True)
+
+    def request(self, user, method, url, data=None, status=200):
+        """Запрос с проверкой ответа и объявленного бюджета"""
+        cache.clear()
+        local_cache.clear()
+        self.warm_versions()
+        response = getattr(self.get_client(user), method)(
+            url, data, format='json'
+        )
+        self.assertEqual(
+            response.status_code, status,
+            None if response.streaming else response.content
+        )
+        endpoints = get_endpoint_stats()['endpoints']
+        self.assertEqual(len(endpoints), 1)
+        self.assertIsNotNone(
+            endpoints[0]['budget'],
+            f'{endpoints[0]["endpoint"]}: бюджет запросов не объявлен'
+        )
+        reset_endpoint_stats()
+        return response
+
+    def test_recipe_list(self):
+        for user in (None, self.viewer):
+            for query in (
+                '', '?tags=breakfast&tags=dinner',
+                f'?author={self.author.pk}',
+                '?ordering=-favorites_count', '?search=рецепт',
+                '?cursor=&with_count=1', '?page=2&limit=3',
+            ):
+                with self.subTest(user=user, query=query):
+                    self.request(user, 'get', f'/api/recipes/{query}')
+        for query in ('?is_favorited=1', '?is_in_shopping_cart=1'):
+            with self.subTest(query=query):
+                self.request(self.viewer, 'get', f'/api/recipes/{query}')
+
+    def test_recipe_list_cached(self):
+        """Общая страница из кэша: версии данных и сама страница"""
+        client = APIClient()
+        client.get('/api/recipes/')
+        with query_budget(2):
+            response = client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipe_detail(self):
+        for user in (None, self.viewer):
+            with self.subTest(user=user):
+                self.request(
+                    user, 'get', f'/api/recipes/{self.recipes[1].pk}/'
+                )
+
+    def test_feed(self):
+        self.request(self.viewer, 'get', '/api/recipes/feed/')
+        self.request(self.viewer, 'get', '/api/recipes/feed/?with_count=1')
+
+    def test_download_shopping_cart(self):
+        response = self.request(
+            self.viewer, 'get', '/api/recipes/download_shopping_cart/'
+        )
+        b''.join(response.streaming_content)
+
+    def test_recipe_create(self):
+        self.request(
+            self.author, 'post', '/api/recipes/', self.get_recipe_data(),
+            status=201
+        )
+
+    def test_recipe_update(self):
+        recipe = self.recipes[1]
+        url = f'/api/recipes/{recipe.pk}/'
+        # Часть ингредиентов и тегов меняется, в том числе в корзинах
+        data = self.get_recipe_data(
+            tags=[self.tags[2].pk],
+            ingredients=[
+                {'id': self.ingredients[0].pk, 'amount': 50},
+                {'id': self.ingredients[3].pk, 'amount': 1},
+            ]
+        )
+        self.request(self.author, 'patch', url, data)
+        del data['image']
+        data['name'] = 'Рецепт без нового изображения'
+        self.request(self.author, 'put', url, data)
+
+    def test_recipe_delete(self):
+        # Рецепт в избранном и в корзинах двух пользователей
+        self.request(
+            self.other_author, 'delete',
+            f'/api/recipes/{self.recipes[4].pk}/', status=204
+        )
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.recipes[1].pk}/favorite/'
+        self.request(self.viewer, 'post', url, status=201)
+        self.request(self.viewer, 'delete', url, status=204)
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+        self.request(self.viewer, 'post', url, status=201)
+        self.request(self.viewer, 'delete', url, status=204)
+
+    def test_batch(self):
+        recipe_ids = [recipe.pk for recipe in self.recipes] + [10 ** 6]
+        for relation in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{relation}/batch/'
+            with self.subTest(relation=relation):
+                self.request(
+                    self.viewer, 'post', url, {'recipes': recipe_ids}
+                )
+                self.request(
+                    self.viewer, 'delete', url, {'recipes': recipe_ids}
+                )
+
+    def test_users(self):
+        self.request(None, 'get', '/api/users/')
+        self.request(self.viewer, 'get', '/api/users/')
+        self.request(self.viewer, 'get', f'/api/users/{self.author.pk}/')
+        self.request(self.viewer, 'get', '/api/users/me/')
+
+    def test_subscriptions(self):
+        for query in ('', '?recipes_limit=2', '?cursor=&with_count=1'):
+            with self.subTest(query=query):
+                self.request(
+                    self.viewer, 'get', f'/api/users/subscriptions/{query}'
+                )
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.other_author.pk}/subscribe/'
+        self.request(self.viewer, 'post', url, status=201)
+        self.request(self.viewer, 'delete', url)
+
+    def test_tags_and_ingredients(self):
+        for user in (None, self.viewer):
+            with self.subTest(user=user):
+                self.request(user, 'get', '/api/tags/')
+                self.request(user, 'get', f'/api/tags/{self.tags[0].pk}/')
+                self.request(user, 'get', '/api/ingredients/?name=мо')
+                self.request(
+                    user, 'get', f'/api/ingredients/{self.ingredients[0].pk}/'
+                )
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(TagViewSet, 'query_budgets', {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                APIClient().get('/api/tags/')
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(0):
+                Tag.objects.count()
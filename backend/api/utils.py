@@ -1,15 +1,44 @@
+import os
+import tempfile
+from collections import defaultdict
+
 import django_filters
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber
+from django.http import FileResponse
 from django_filters.widgets import BooleanWidget
 from reportlab.pdfbase import pdfmetrics, ttfonts
 from reportlab.pdfgen import canvas
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from app.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                        ShoppingListItem)
+from app.search import search_ingredients, search_recipes
+from users.models import Follow
 
-from app.models import Ingredient, Recipe, RecipeIngredient, Tag
+PDF_FONT = "Arial"
+PDF_FONT_SIZE = 14
+PDF_LINE_HEIGHT = 25
+PDF_BOTTOM_MARGIN = 50
+# До этого размера PDF собирается в памяти, дальше - во временном файле
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_CHUNK_SIZE = 64 * 1024
+
+TAGS_MATCH_CHOICES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
 
 
 class IngredientsFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(field_name='name', lookup_expr='contains')
+    name = django_filters.CharFilter(method='search_name')
+
+    def search_name(self, queryset, name, value):
+        return search_ingredients(queryset, value)
 
     class Meta:
         model = Ingredient
@@ -18,61 +47,261 @@ class IngredientsFilter(django_filters.FilterSet):
 
 class RecipeFilter(django_filters.FilterSet):
     author = django_filters.CharFilter(field_name='author_id')
-    tags = django_filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = django_filters.CharFilter(method='filter_tags')
+    tags_match = django_filters.ChoiceFilter(
+        choices=TAGS_MATCH_CHOICES,
+        method='filter_nothing',
+        label='Совпадение тегов: any - любой, all - все.'
     )
     is_in_shopping_cart = django_filters.BooleanFilter(
         widget=BooleanWidget(),
+        method='filter_is_in_shopping_cart',
         label='В корзине.'
     )
     is_favorited = django_filters.BooleanFilter(
         widget=BooleanWidget(),
+        method='filter_is_favorited',
         label='В избранных.'
     )
+    # До ordering: явная сортировка заменяет сортировку по релевантности
+    search = django_filters.CharFilter(
+        method='filter_search',
+        label='Поиск по названию и описанию.'
+    )
+    ordering = django_filters.OrderingFilter(
+        fields=('favorites_count', 'id'),
+        label='Сортировка.'
+    )
+
+    def filter_tags(self, queryset, name, value):
+        """Полусоединение EXISTS по таблице связей вместо JOIN и DISTINCT.
+
+        Параметр tags можно передать несколько раз. По умолчанию нужен
+        любой из тегов, при tags_match=all - все сразу.
+        """
+        slugs = set(self.data.getlist(name))
+        if self.form.cleaned_data.get('tags_match') == 'all':
+            for slug in slugs:
+                queryset = queryset.filter(Exists(
+                    Recipe.tags.through.objects.filter(
+                        recipe_id=OuterRef('pk'), tag__slug=slug
+                    )
+                ))
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'), tag__slug__in=slugs
+        )))
+
+    def filter_nothing(self, queryset, name, value):
+        return queryset
+
+    def filter_viewer_relation(self, queryset, relation, value):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none() if value else queryset
+        exists = Exists(relation.objects.filter(
+            user=user, recipe_id=OuterRef('pk')
+        ))
+        return queryset.filter(exists if value else ~exists)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_viewer_relation(queryset, FavoriteRecipe, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_viewer_relation(queryset, ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_in_shopping_cart', 'is_favorited']
+        fields = ['author', 'tags', 'tags_match', 'is_in_shopping_cart',
+                  'is_favorited', 'search']
+
+
+class KeysetPagination(CursorPagination):
+    """Постраничный вывод по ключу id: без OFFSET и без подсчета записей.
+
+    Порядок - как у страниц без cursor: сортировка queryset, а если она
+    не задана - сортировка модели по умолчанию. По ключу id нельзя
+    листать другую сортировку (ordering=favorites_count, релевантность
+    поиска), такие запросы получают ответ 400. Общее количество
+    считается только по запросу (with_count=1).
+    """
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    count_query_param = 'with_count'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = (
+            tuple(queryset.query.order_by)
+            or tuple(queryset.model._meta.ordering)
+            or (self.ordering,)
+        )
+        if ordering not in (('id',), ('-id',)):
+            raise ValidationError({self.cursor_query_param: (
+                'Постраничный вывод по ключу возможен только в порядке '
+                'id, параметры ordering и search с ним не совмещаются.'
+            )})
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+            response.data.move_to_end('count', last=False)
+        return response
 
 
 class CustomPageNumberPagination(PageNumberPagination):
+    """Постраничный вывод с page/limit.
+
+    При наличии параметра cursor (в том числе пустого - первая страница)
+    используется постраничный вывод по ключу.
+    """
     page_size_query_param = 'limit'
+    keyset_pagination_class = KeysetPagination
 
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.keyset_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.keyset_paginator = self.keyset_pagination_class()
+            return self.keyset_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
 
-def get_pdf_shopping_cart(request):
-    """Генерация списка покупок в виде PDF формата"""
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = ("attachment; "
-                                       "filename=shopping_cart.pdf")
-
-    p = canvas.Canvas(response)
-    arial = ttfonts.TTFont("Arial", "data/arial.ttf")
-    pdfmetrics.registerFont(arial)
-    p.setFont("Arial", 14)
-
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__cart__user=request.user
-    ).values_list(
-        "ingredient__name", "amount", "ingredient__measurement_unit"
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def get_subscriptions(user, author_ids):
+    """Множество id авторов из author_ids, на которых подписан user"""
+    if user.is_anonymous or not author_ids:
+        return set()
+    return set(Follow.objects.filter(
+        follower=user, following_id__in=set(author_ids)
+    ).values_list('following_id', flat=True))
+
+
+def get_media_url(request, path):
+    """Абсолютная ссылка на файл в хранилище"""
+    return request.build_absolute_uri(default_storage.url(path))
+
+
+def get_rendition_urls(request, renditions):
+    """Ссылки на варианты изображения: {'thumbnail': {'webp': url}, ...}"""
+    return {
+        name: {
+            extension: get_media_url(request, path)
+            for extension, path in formats.items()
+        }
+        for name, formats in renditions.items()
+    }
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если он не задан"""
+    try:
+        return max(int(request.GET.get('recipes_limit')), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_recipe_previews(author_ids, limit=None):
+    """Последние рецепты авторов одним запросом: {author_id: [recipe]}.
+
+    При заданном limit каждому автору достается не больше limit рецептов:
+    строки нумеруются оконной функцией в разрезе автора.
+    """
+    previews = defaultdict(list)
+    if not author_ids:
+        return previews
+
+    queryset = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'author_id', 'name', 'image', 'image_renditions', 'cooking_time'
     )
+    if limit is None:
+        recipes = queryset.order_by('-id')
+    else:
+        ranked = queryset.annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=F('id').desc(),
+        )).values(
+            'id', 'author_id', 'name', 'image', 'image_renditions',
+            'cooking_time', 'recipe_rank'
+        )
+        sql, params = ranked.query.sql_with_params()
+        rank = connection.ops.quote_name('recipe_rank')
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE ranked.{rank} <= %s '
+            f'ORDER BY ranked.{rank}',
+            (*params, limit)
+        )
 
-    ingr_list = {}
-    for name, amount, unit in ingredients:
-        if name not in ingr_list:
-            ingr_list[name] = {"amount": amount, "unit": unit}
-        else:
-            ingr_list[name]["amount"] += amount
-    height = 700
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    return previews
+
+
+def register_pdf_font():
+    """Регистрация шрифта для PDF (один раз на процесс)"""
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(ttfonts.TTFont(
+            PDF_FONT, os.path.join(settings.BASE_DIR, 'data', 'arial.ttf')
+        ))
+
+
+def get_shopping_cart_ingredients(user):
+    """Суммарное количество каждого ингредиента из корзины пользователя"""
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).order_by('ingredient__name').values_list(
+        'ingredient__name', 'total_amount', 'ingredient__measurement_unit'
+    )
+
+
+def draw_shopping_cart(output, ingredients):
+    """Постраничная отрисовка списка покупок в PDF"""
+    register_pdf_font()
+    p = canvas.Canvas(output, pageCompression=1)
+    p.setFont(PDF_FONT, PDF_FONT_SIZE)
 
     p.drawString(100, 750, "Список покупок")
-    for i, (name, data) in enumerate(ingr_list.items(), start=1):
-        p.drawString(
-            80, height, f"{i}. {name} – {data['amount']} {data['unit']}"
-        )
-        height -= 25
+    height = 700
+    for i, (name, amount, unit) in enumerate(ingredients, start=1):
+        if height < PDF_BOTTOM_MARGIN:
+            p.showPage()
+            p.setFont(PDF_FONT, PDF_FONT_SIZE)
+            height = 750
+        p.drawString(80, height, f"{i}. {name} – {amount} {unit}")
+        height -= PDF_LINE_HEIGHT
     p.showPage()
     p.save()
 
+
+def get_pdf_shopping_cart(request):
+    """Генерация списка покупок в виде PDF формата"""
+    output = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+    draw_shopping_cart(
+        output, get_shopping_cart_ingredients(request.user).iterator()
+    )
+    output.seek(0)
+
+    response = FileResponse(
+        output, as_attachment=True, filename="shopping_cart.pdf",
+        content_type="application/pdf"
+    )
+    response.block_size = PDF_CHUNK_SIZE
     return response
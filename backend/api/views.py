@@ -1,29 +1,69 @@
+import os
 from http import HTTPStatus
 
+from django.core.files.storage import default_storage
 from django.db import transaction
 from django.db.models import Exists, OuterRef
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.permissions import CurrentUserOrAdminOrReadOnly
 from djoser.views import UserViewSet
-from rest_framework import status, viewsets
+from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from app.batch import (add_favorites, add_to_cart, remove_favorites,
+                       remove_from_cart)
+from app.locks import locked_recipes
 from app.models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
                         ShoppingCart, Tag)
+from app.versions import bump_versions
+from foodgram.db.pool import get_pools_stats
+from jobs.models import Job
+from jobs.queue import enqueue
 from users.models import Follow, User
 
+from .cache import (apply_viewer_overlay, conditional_get,
+                    get_cached_recipe_list, get_recipe_list_scopes,
+                    is_shared_recipe_list)
+from .instrumentation import get_endpoint_stats, reset_endpoint_stats
 from .permissions import IsAdminAuthorOrReadOnly, IsAdminOrReadOnly
-from .serializers import (CustomUserSerializer, FavoriteRecipeSerializer,
-                          FollowCheckSubscribeSerializer, FollowSerializer,
-                          IngredientsSerializer, RecipeGETSerializer,
-                          RecipeIngredientSerializer, RecipeSerializer,
-                          ShoppingCartSerializer, TagSerializer)
+from .readers import recipe_values, serialize_recipes
+from .renderers import FastJSONRenderer
+from .serializers import (CustomUserSerializer, FollowCheckSubscribeSerializer,
+                          FollowSerializer, IngredientsSerializer,
+                          JobSerializer, RecipeGETSerializer,
+                          RecipeIdsSerializer, RecipeIngredientSerializer,
+                          RecipeSerializer, TagSerializer)
 from .utils import (CustomPageNumberPagination, IngredientsFilter,
-                    RecipeFilter, get_pdf_shopping_cart)
+                    KeysetPagination, RecipeFilter, get_pdf_shopping_cart,
+                    get_recipe_previews, get_recipes_limit, get_subscriptions)
+
+
+class SubscriptionsContextMixin:
+    """Подписки пользователя на авторов всей страницы одним запросом.
+
+    При сериализации списка в контекст попадает множество id авторов,
+    на которых подписан пользователь; поле указывается в author_field.
+    """
+    author_field = 'pk'
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            context = self.get_serializer_context()
+            context['subscriptions'] = get_subscriptions(
+                self.request.user,
+                [getattr(obj, self.author_field) for obj in args[0]]
+            )
+            kwargs['context'] = context
+        return super().get_serializer(*args, **kwargs)
 
 
 class RecipesView(viewsets.ModelViewSet):
@@ -32,20 +72,51 @@ class RecipesView(viewsets.ModelViewSet):
     serializer_class = RecipeGETSerializer
     pagination_class = CustomPageNumberPagination
     permission_classes = (IsAdminAuthorOrReadOnly,)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    # Запросов к БД на ответ по плану, включая проверку токена
+    # (api/budgets.py, транзакции считаются запросом BEGIN):
+    # create - проверка тегов, названия и ингредиентов, транзакция
+    # с рецептом (варианты изображения в той же строке), счетчиком
+    # автора, тегами и составом, рассылка по лентам (подписчики,
+    # транзакция, вставка), версии, теги и состав для ответа;
+    # update - транзакция, рецепт с блокировкой, три проверки, теги
+    # (текущие, удаление, вставка), состав (текущий, удаление,
+    # изменение, вставка), списки покупок (см. shopping_cart), рецепт,
+    # версии, теги и состав для ответа;
+    # destroy - рецепт, транзакция, избранное (держатели, удаление),
+    # строки для сигналов (состав, избранное, корзины), списки покупок
+    # (блокировка рецепта, состав, держатели корзин, см. shopping_cart),
+    # удаление тегов, ленты, состава, корзин и рецепта, счетчик автора,
+    # версии;
+    # favorite - транзакция, блокировка рецептов, связи, изменение,
+    # счетчики, версии; shopping_cart - вместо счетчиков состав
+    # рецептов и списки покупок (блокировка пользователей, позиции,
+    # изменение, вставка или удаление обнулившихся).
+    query_budgets = {
+        'list': 9, 'retrieve': 6, 'feed': 7, 'download_shopping_cart': 2,
+        'create': 15, 'update': 23, 'partial_update': 23, 'destroy': 22,
+        'favorite': 7, 'delete_favorite': 7,
+        'shopping_cart': 11, 'delete_shopping_cart': 11,
+        'favorite_batch': 7, 'shopping_cart_batch': 11,
+    }
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeGETSerializer
         return RecipeSerializer
 
+    def get_base_queryset(self):
+        if self.request.method in ('PUT', 'PATCH'):
+            # Рецепт блокируется при чтении, до проверки и изменения
+            # состава (app.locks.lock_recipes): транзакцию открывает update.
+            # Автор нужен проверке уникальности названия при PATCH
+            return locked_recipes().select_related('author')
+        return Recipe.objects.all()
+
     def get_queryset(self):
-        queryset = (
-            Recipe.objects
-            .select_related('author')
-            .prefetch_related('tags', 'ingredients')
-        )
+        queryset = self.get_base_queryset()
         if self.request.user.is_authenticated:
             return queryset.annotate(
                 is_favorited=Exists(FavoriteRecipe.objects.filter(
@@ -57,22 +128,84 @@ class RecipesView(viewsets.ModelViewSet):
             )
         return queryset
 
-    @transaction.atomic()
+    @conditional_get(get_recipe_list_scopes)
+    def list(self, request, *args, **kwargs):
+        if not is_shared_recipe_list(request):
+            return Response(self.get_list_data(self.get_queryset()))
+        data = get_cached_recipe_list(request, self.get_shared_list_data)
+        return Response(apply_viewer_overlay(data, request.user))
+
+    @conditional_get('recipe:{pk}', 'tags', 'ingredients', 'users')
+    def retrieve(self, request, *args, **kwargs):
+        recipe = generics.get_object_or_404(
+            recipe_values(self.get_queryset()), pk=kwargs['pk']
+        )
+        self.check_object_permissions(request, recipe)
+        return Response(serialize_recipes([recipe], request)[0])
+
+    @action(detail=False, methods=['GET'],
+            permission_classes=[IsAuthenticated])
+    @conditional_get(get_recipe_list_scopes)
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые первыми.
+
+        Постраничный вывод всегда по ключу, поэтому ordering и search
+        здесь не поддерживаются (KeysetPagination).
+        """
+        queryset = self.filter_queryset(
+            self.get_queryset().filter(feed_entries__user=request.user)
+        )
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(
+            recipe_values(queryset), request, view=self
+        )
+        return paginator.get_paginated_response(
+            serialize_recipes(page, request)
+        )
+
+    def get_list_data(self, queryset, subscriptions=None):
+        """Страница списка рецептов без объектов моделей"""
+        page = self.paginate_queryset(
+            recipe_values(self.filter_queryset(queryset))
+        )
+        return self.get_paginated_response(
+            serialize_recipes(page, self.request, subscriptions)
+        ).data
+
+    def get_shared_list_data(self):
+        """Страница списка рецептов без данных о текущем пользователе"""
+        return self.get_list_data(self.get_base_queryset(), set())
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic()
+    def perform_destroy(self, instance):
+        # Избранное - одним DELETE (как в app/batch.py): сигнал на каждую
+        # строку уменьшал бы счетчик самого удаляемого рецепта
+        favorites = instance.favorites.all()
+        user_ids = list(favorites.values_list('user_id', flat=True))
+        if user_ids:
+            favorites._raw_delete(favorites.db)
+            bump_versions(*(f'viewer:{pk}' for pk in user_ids))
+        instance.delete()
+
+    @transaction.atomic()
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
     @action(
         detail=False,
         methods=['POST'],
         url_path=r'(?P<recipe_id>\d+)/favorite'
     )
     def favorite(self, request, recipe_id):
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        serializer = FavoriteRecipeSerializer(
-            data={"recipe": recipe.pk}, context={"request": self.request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(user=self.request.user, recipe=recipe)
+        if not self.change_recipe(add_favorites, recipe_id):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Этот рецепт уже есть в избранном'
+                ]
+            })
         return Response(
             {"Message": "Рецепт успешно добавлен в избранное"},
             status=status.HTTP_201_CREATED
@@ -80,10 +213,7 @@ class RecipesView(viewsets.ModelViewSet):
 
     @favorite.mapping.delete
     def delete_favorite(self, request, recipe_id):
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        favorite_recipe = recipe.favorites.filter(user=self.request.user)
-        if favorite_recipe.exists():
-            favorite_recipe.delete()
+        if self.change_recipe(remove_favorites, recipe_id):
             return Response(
                 {'Message': "Рецепт успешно удален из избранного"},
                 status=status.HTTP_204_NO_CONTENT
@@ -93,9 +223,67 @@ class RecipesView(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def change_recipe(self, change, recipe_id):
+        """Изменить связь пользователя с одним рецептом пакетной функцией
+        (app/batch.py), вернуть, изменилось ли что-нибудь.
+
+        Наличие рецепта проверяет сама блокировка его строки.
+        """
+        found, changed = change(self.request.user, [int(recipe_id)])
+        if not found:
+            raise Http404
+        return bool(changed)
+
+    @action(
+        detail=False, methods=['POST', 'DELETE'], url_path='favorite/batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        """Добавить (POST) или убрать (DELETE) несколько рецептов"""
+        return self.get_batch_response(
+            request, add_favorites, remove_favorites
+        )
+
+    @action(
+        detail=False, methods=['POST', 'DELETE'],
+        url_path='shopping_cart/batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        """Добавить (POST) или убрать (DELETE) несколько рецептов"""
+        return self.get_batch_response(request, add_to_cart, remove_from_cart)
+
+    def get_batch_response(self, request, add, remove):
+        """Пакетное изменение: по каждому id created/exists (POST),
+        deleted/absent (DELETE) или not_found"""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            found, changed = add(request.user, recipe_ids)
+            done, skipped = 'created', 'exists'
+        else:
+            found, changed = remove(request.user, recipe_ids)
+            done, skipped = 'deleted', 'absent'
+        results = dict.fromkeys(recipe_ids, 'not_found')
+        results.update(dict.fromkeys(found, skipped))
+        results.update(dict.fromkeys(changed, done))
+        return Response({'results': [
+            {'id': pk, 'status': value} for pk, value in results.items()
+        ]})
+
     @action(detail=False, permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        """Предоставить список покупок пользователю в PDF формате"""
+        """Предоставить список покупок пользователю в PDF формате.
+
+        С параметром background=1 PDF готовится фоновой задачей, а в ответ
+        приходит задача, статус которой можно узнать в /api/jobs/<id>/.
+        """
+        if request.query_params.get('background'):
+            job = enqueue('shopping_cart_pdf', user=request.user)
+            return Response(
+                JobSerializer(job).data, status=status.HTTP_202_ACCEPTED
+            )
         return get_pdf_shopping_cart(request)
 
     @action(
@@ -104,14 +292,12 @@ class RecipesView(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def shopping_cart(self, request, recipe_id):
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-
-        serializer = ShoppingCartSerializer(
-            data={'user': self.request.user.pk, 'recipe': recipe.pk},
-            context={'request': self.request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(user=self.request.user, recipe=recipe)
+        if not self.change_recipe(add_to_cart, recipe_id):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Вы уже добавили рецепт в корзину.'
+                ]
+            })
         return Response(
             {'Message': 'Рецепт успешно добавлен в список покупок'},
             status=HTTPStatus.CREATED
@@ -119,10 +305,7 @@ class RecipesView(viewsets.ModelViewSet):
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, recipe_id):
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        del_recipe = recipe.cart.filter(user=self.request.user)
-        if del_recipe.exists():
-            del_recipe.delete()
+        if self.change_recipe(remove_from_cart, recipe_id):
             return Response(
                 {'Message': "Рецепт успешно удален из списка покупок"},
                 status=status.HTTP_204_NO_CONTENT
@@ -141,27 +324,49 @@ class IngredientsView(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientsFilter
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = None
+    # Токен, версии, ингредиенты; список - и загрузка индекса поиска
+    query_budgets = {'list': 4, 'retrieve': 3}
+
+    @conditional_get('ingredients')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get('ingredients')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(SubscriptionsContextMixin, UserViewSet):
     """Представление для пользователей Djoiser"""
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
+    pagination_class = CustomPageNumberPagination
     permission_classes = [CurrentUserOrAdminOrReadOnly]
+    query_budgets = {'list': 4, 'retrieve': 3, 'me': 1, 'subscriptions': 4}
 
     def get_permissions(self):
         if self.action == 'me':
             self.permission_classes = [IsAuthenticated]
         return super().get_permissions()
 
-    @action(detail=False, methods=['GET'], url_path='subscriptions')
+    @action(
+        detail=False, methods=['GET'], url_path='subscriptions',
+        permission_classes=[IsAuthenticated]
+    )
     def subscriptions(self, request):
         """Страница всех подписок пользователя"""
         current_user = self.request.user
-        authors = Follow.objects.filter(follower=current_user)
+        authors = Follow.objects.filter(
+            follower=current_user
+        ).select_related('following').order_by('id')
         page = self.paginate_queryset(authors)
+        recipes = get_recipe_previews(
+            [follow.following_id for follow in page],
+            get_recipes_limit(request)
+        )
         data = FollowSerializer(
-            page, many=True, context={'request': self.request}
+            page, many=True,
+            context={'request': self.request, 'recipes': recipes}
         )
         return self.get_paginated_response(data.data)
 
@@ -170,6 +375,11 @@ class UserSubscribeViewSet(APIView):
     """Подписки/Отписки на авторов рецептов"""
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated]
+    # Токен, автор, проверка подписки; подписка - вставка, рецепты
+    # автора для ленты (транзакция, вставка), версии, рецепты для ответа;
+    # отписка - подписка для сигналов, транзакция, удаление подписки и
+    # ленты, версии
+    query_budgets = {'post': 9, 'delete': 8}
 
     def post(self, request, user_id):
         """Подписка на пользователя по его ID"""
@@ -177,8 +387,7 @@ class UserSubscribeViewSet(APIView):
         user = request.user
 
         serializer = FollowCheckSubscribeSerializer(
-            data={"following": author.pk, "follower": user.pk},
-            context={'request': request}
+            data={}, context={'request': request, 'author': author}
         )
         serializer.is_valid(raise_exception=True)
 
@@ -192,8 +401,7 @@ class UserSubscribeViewSet(APIView):
         user = request.user
 
         serializer = FollowCheckSubscribeSerializer(
-            data={"following": author.pk, "follower": user.pk},
-            context={'request': request}
+            data={}, context={'request': request, 'author': author}
         )
         serializer.is_valid(raise_exception=True)
 
@@ -205,8 +413,71 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    # Токен, версии, теги
+    query_budgets = {'list': 3, 'retrieve': 3}
+
+    @conditional_get('tags')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get('tags')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
 class RecipeIngredientViewSet(viewsets.ModelViewSet):
     queryset = RecipeIngredient.objects.all()
     serializer_class = RecipeIngredientSerializer
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Фоновые задачи пользователя и их результаты"""
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True)
+    def download(self, request, pk):
+        """Скачать файл, подготовленный задачей"""
+        job = self.get_object()
+        path = (job.result or {}).get('file')
+        if job.status != Job.DONE or not path:
+            return Response(
+                {'errors': 'Файл еще не готов'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return FileResponse(
+            default_storage.open(path, 'rb'), as_attachment=True,
+            filename=os.path.basename(path)
+        )
+
+
+class DatabasePoolMetricsView(APIView):
+    """Пулы подключений к БД процесса, обработавшего запрос.
+
+    Каждый воркер держит свои пулы: под нагрузкой запросы попадают
+    в разные процессы (pid в ответе). Для подбора max_connections
+    PostgreSQL: число воркеров * SIZE + запас для команд и миграций.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_pools_stats())
+
+
+class RequestMetricsView(APIView):
+    """Запросы к БД и время ответа по представлениям процесса.
+
+    Время в миллисекундах, среднее на запрос. DELETE сбрасывает
+    статистику, например перед замером.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_endpoint_stats())
+
+    def delete(self, request):
+        reset_endpoint_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
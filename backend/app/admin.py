@@ -1,9 +1,12 @@
 from colorfield.fields import ColorField
 from django import forms
 from django.contrib import admin
+from django.db import transaction
 from django.utils.safestring import mark_safe
 
 from . import models
+from .locks import lock_recipes
+from .shopping_list import get_recipe_amounts, recipe_ingredients_changed
 
 
 @admin.register(models.Ingredient)
@@ -31,6 +34,18 @@ class RecipeAdmin(admin.ModelAdmin):
         IngredientsInlineAdmin
     ]
 
+    @transaction.atomic()
+    def save_related(self, request, form, formsets, change):
+        # Состав меняется формами ингредиентов: списки покупок держателей
+        # корзин пересчитываются по разнице, как при изменении через API
+        recipe = form.instance
+        lock_recipes([recipe.pk])
+        old_amounts = get_recipe_amounts(recipe)
+        super().save_related(request, form, formsets, change)
+        recipe_ingredients_changed(
+            recipe, old_amounts, get_recipe_amounts(recipe)
+        )
+
     def get_image(self, obj):
         return mark_safe(f'<img src={obj.image.url} height=40px weight=40px>')
 
@@ -38,7 +53,7 @@ class RecipeAdmin(admin.ModelAdmin):
         return "\n, ".join([tag.name for tag in obj.tags.all()])
 
     def get_favorites_count(self, obj):
-        return models.FavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
     def get_ingredients(self, obj):
         return "\n, ".join(
@@ -48,6 +63,7 @@ class RecipeAdmin(admin.ModelAdmin):
     get_image.short_description = 'Фотография рецепта'
     get_tags.short_description = 'Теги рецепта'
     get_favorites_count.short_description = 'Количество добавлений в избранное'
+    get_favorites_count.admin_order_field = 'favorites_count'
     get_ingredients.short_description = 'Ингредиенты'
 
 
@@ -61,9 +77,24 @@ class TagAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
 
 
-admin.site.register(models.RecipeIngredient)
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Только просмотр: изменения мимо API и формы рецепта не попали бы
+    в сводные списки покупок"""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(models.RecipeIngredient, ReadOnlyAdmin)
 admin.site.register(models.FavoriteRecipe)
-admin.site.register(models.ShoppingCart)
+admin.site.register(models.ShoppingCart, ReadOnlyAdmin)
+admin.site.register(models.ShoppingListItem, ReadOnlyAdmin)
 
 admin.site.index_title = 'Админка'
 admin.site.site_title = 'Foodgram'
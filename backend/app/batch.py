@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.models import F
+
+from app.locks import lock_recipes
+from app.models import FavoriteRecipe, Recipe, ShoppingCart
+from app.shopping_list import (add_recipes_to_shopping_list,
+                               remove_recipes_from_shopping_list)
+from app.versions import bump_versions
+
+
+def insert_user_recipes(model, user, recipe_ids):
+    """Добавить связи пользователя с рецептами.
+
+    Возвращает id найденных рецептов и id добавленных связей.
+    Рецепты блокируются (lock_recipes) до чтения уже добавленных: пока
+    блокировка держится, этот набор не меняется, поэтому вставляются
+    ровно возвращенные строки, и счетчики и списки покупок считаются
+    по ним точно.
+    """
+    found = lock_recipes(recipe_ids)
+    existing = set(model.objects.filter(
+        user=user, recipe_id__in=found
+    ).values_list('recipe_id', flat=True))
+    created = [pk for pk in found if pk not in existing]
+    model.objects.bulk_create(
+        [model(user=user, recipe_id=pk) for pk in created]
+    )
+    if created:
+        bump_versions(f'viewer:{user.pk}')
+    return found, created
+
+
+def delete_user_recipes(model, user, recipe_ids):
+    """Удалить связи пользователя с рецептами.
+
+    Возвращает id найденных рецептов и id удаленных связей.
+    Рецепты блокируются, как при добавлении. Удаление - одним DELETE
+    (_raw_delete) без сигналов на каждую строку, которые QuerySet.delete()
+    вызывает для каждой удаленной строки: счетчики и версии обновляет
+    вызывающий код по возвращенным id.
+    """
+    found = lock_recipes(recipe_ids)
+    links = model.objects.filter(user=user, recipe_id__in=found)
+    deleted = list(links.values_list('recipe_id', flat=True))
+    if deleted:
+        links._raw_delete(links.db)
+        bump_versions(f'viewer:{user.pk}')
+    return found, deleted
+
+
+@transaction.atomic()
+def add_favorites(user, recipe_ids):
+    found, created = insert_user_recipes(FavoriteRecipe, user, recipe_ids)
+    if created:
+        Recipe.objects.filter(pk__in=created).update(
+            favorites_count=F('favorites_count') + 1
+        )
+        bump_versions('favorites')
+    return found, created
+
+
+@transaction.atomic()
+def remove_favorites(user, recipe_ids):
+    found, deleted = delete_user_recipes(FavoriteRecipe, user, recipe_ids)
+    if deleted:
+        Recipe.objects.filter(pk__in=deleted, favorites_count__gt=0).update(
+            favorites_count=F('favorites_count') - 1
+        )
+        bump_versions('favorites')
+    return found, deleted
+
+
+@transaction.atomic()
+def add_to_cart(user, recipe_ids):
+    found, created = insert_user_recipes(ShoppingCart, user, recipe_ids)
+    add_recipes_to_shopping_list(user, created)
+    return found, created
+
+
+@transaction.atomic()
+def remove_from_cart(user, recipe_ids):
+    found, deleted = delete_user_recipes(ShoppingCart, user, recipe_ids)
+    remove_recipes_from_shopping_list(user, deleted)
+    return found, deleted
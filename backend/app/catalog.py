@@ -0,0 +1,132 @@
+import csv
+import json
+from io import StringIO
+
+from django.db import connection
+
+from app.models import Ingredient, Tag
+
+# Размер куска файла при потоковом разборе JSON
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = ' \t\r\n,'
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """Элементы JSON-массива по одному, без чтения всего файла"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив')
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_SEPARATORS:
+            position += 1
+        if buffer[position:position + 1] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            item, end = None, None
+        # Число в конце куска могло быть прочитано не полностью
+        if end is not None and (end < len(buffer) or eof):
+            yield item
+            position = end
+            continue
+        if eof:
+            raise ValueError('JSON-массив не закончен')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_source(file, name):
+    """Строки CSV (название, единица) или элементы JSON-массива"""
+    if name.endswith('.csv'):
+        for row in csv.reader(file):
+            if row:
+                yield {'name': row[0], 'measurement_unit': row[1]}
+        return
+    yield from iter_json_array(file)
+
+
+def copy_upsert_ingredients(units):
+    """PostgreSQL: COPY во временную таблицу и INSERT ... ON CONFLICT"""
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    data = StringIO()
+    csv.writer(data).writerows(units.items())
+    data.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS ingredient_load '
+            '(name varchar(170), measurement_unit varchar(30))'
+        )
+        cursor.execute('TRUNCATE ingredient_load')
+        cursor.copy_expert(
+            'COPY ingredient_load FROM STDIN WITH (FORMAT csv)', data
+        )
+        # xmax = 0 только у вставленных строк, у обновленных - нет
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT name, measurement_unit FROM ingredient_load '
+            'ON CONFLICT (name) DO UPDATE '
+            'SET measurement_unit = EXCLUDED.measurement_unit '
+            f'WHERE {table}.measurement_unit '
+            'IS DISTINCT FROM EXCLUDED.measurement_unit '
+            'RETURNING (xmax = 0)'
+        )
+        flags = [row[0] for row in cursor.fetchall()]
+    return flags.count(True), flags.count(False)
+
+
+def get_ingredients(names):
+    """{name: (pk, measurement_unit)} с учетом лимита параметров запроса"""
+    names = list(names)
+    step = connection.ops.bulk_batch_size(['name'], names) or 1
+    result = {}
+    for start in range(0, len(names), step):
+        result.update(
+            (name, (pk, unit)) for name, pk, unit
+            in Ingredient.objects.filter(
+                name__in=names[start:start + step]
+            ).values_list('name', 'pk', 'measurement_unit')
+        )
+    return result
+
+
+def orm_upsert_ingredients(units):
+    existing = get_ingredients(units)
+    Ingredient.objects.bulk_create(
+        [Ingredient(name=name, measurement_unit=unit)
+         for name, unit in units.items() if name not in existing],
+        ignore_conflicts=True
+    )
+    changed = [
+        Ingredient(pk=pk, measurement_unit=units[name])
+        for name, (pk, unit) in existing.items() if unit != units[name]
+    ]
+    Ingredient.objects.bulk_update(changed, ['measurement_unit'])
+    return len(units) - len(existing), len(changed)
+
+
+def upsert_ingredients(units):
+    """Вставить новые ингредиенты и обновить измененные единицы.
+
+    units - {название: единица измерения}. Возвращает количество
+    вставленных и обновленных строк. Сигналы моделей не вызываются.
+    """
+    if not units:
+        return 0, 0
+    if connection.vendor == 'postgresql':
+        return copy_upsert_ingredients(units)
+    return orm_upsert_ingredients(units)
+
+
+def upsert_tag(fields):
+    """Тег по slug: создать или обновить название и цвет, вернуть pk"""
+    tag, _ = Tag.objects.update_or_create(
+        slug=fields['slug'],
+        defaults={'name': fields['name'], 'color': fields['color']}
+    )
+    return tag.pk
@@ -0,0 +1,93 @@
+from itertools import islice
+
+from django.db import transaction
+
+from app.models import FeedEntry, Recipe
+from jobs.queue import enqueue
+from users.models import Follow
+
+FEED_BATCH_SIZE = 1000
+
+
+def create_feed_entries(rows, batch_size=FEED_BATCH_SIZE):
+    """Записать строки (user_id, recipe_id, author_id) пачками"""
+    rows = iter(rows)
+    while True:
+        batch = [
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id)
+            for user_id, recipe_id, author_id in islice(rows, batch_size)
+        ]
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def get_followers(author_id, after=0):
+    """id подписчиков автора больше after, по возрастанию"""
+    return Follow.objects.filter(
+        following_id=author_id, follower_id__gt=after
+    ).order_by('follower_id').values_list('follower_id', flat=True)
+
+
+def fan_out_recipe(recipe_id, author_id, after=0):
+    """Добавить рецепт в ленты подписчиков автора с id больше after"""
+    create_feed_entries(
+        (follower_id, recipe_id, author_id)
+        for follower_id in get_followers(author_id, after).iterator()
+    )
+
+
+def schedule_fan_out(recipe):
+    """Разослать новый рецепт по лентам после фиксации транзакции.
+
+    Запрос сам добавляет рецепт первой пачке из FEED_BATCH_SIZE
+    подписчиков, остальным - фоновая задача feed_fan_out: у популярного
+    автора десятки тысяч подписчиков, и вставка всех строк задержала бы
+    ответ и держала бы транзакцию.
+    """
+    recipe_id, author_id = recipe.pk, recipe.author_id
+
+    def fan_out():
+        followers = list(get_followers(author_id)[:FEED_BATCH_SIZE + 1])
+        create_feed_entries(
+            (follower_id, recipe_id, author_id)
+            for follower_id in followers[:FEED_BATCH_SIZE]
+        )
+        if len(followers) > FEED_BATCH_SIZE:
+            enqueue(
+                'feed_fan_out', recipe_id=recipe_id, author_id=author_id,
+                after=followers[FEED_BATCH_SIZE - 1]
+            )
+
+    transaction.on_commit(fan_out)
+
+
+def backfill_feed(follower_id, author_id):
+    """Добавить в ленту подписчика уже опубликованные рецепты автора"""
+    recipes = Recipe.objects.filter(
+        author_id=author_id
+    ).values_list('pk', flat=True).iterator()
+    create_feed_entries(
+        (follower_id, recipe_id, author_id) for recipe_id in recipes
+    )
+
+
+def trim_feed(follower_id, author_id):
+    """Убрать из ленты рецепты автора после отписки"""
+    FeedEntry.objects.filter(user_id=follower_id, author_id=author_id).delete()
+
+
+def rebuild_feeds(user_ids=None):
+    """Пересоздать ленты по подпискам (после загрузки данных)"""
+    entries = FeedEntry.objects.all()
+    # Один filter(), чтобы values_list использовал то же соединение
+    # с подписками
+    follows = {'author__following__isnull': False}
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        follows = {'author__following__follower_id__in': user_ids}
+    entries.delete()
+    create_feed_entries(Recipe.objects.filter(**follows).values_list(
+        'author__following__follower_id', 'pk', 'author_id'
+    ).iterator())
@@ -0,0 +1,182 @@
+import base64
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from jobs.queue import enqueue
+
+# Максимальный размер сохраняемого оригинала
+ORIGINAL_SIZE = (1920, 1920)
+# Варианты изображения: название -> максимальный размер
+RENDITIONS = {
+    'thumbnail': (360, 360),
+    'medium': (960, 960),
+}
+# Форматы сохранения: расширение -> (формат Pillow, параметры сохранения)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', {'optimize': True}),
+}
+# Форматы вариантов
+RENDITION_FORMATS = ('webp', 'jpeg')
+# Загрузки в этих форматах хранятся в них же (с прозрачностью),
+# остальные - в JPEG
+ORIGINAL_FORMATS = {'PNG': 'png', 'WEBP': 'webp'}
+FILE_EXTENSIONS = {'jpeg': 'jpg'}
+RENDITIONS_DIR = 'recipes/renditions'
+
+# Размер куска base64 для декодирования (кратен 4)
+BASE64_CHUNK_SIZE = 64 * 1024
+# До этого размера картинка декодируется в памяти, дальше - во временный
+# файл
+SPOOL_SIZE = 1024 * 1024
+
+RESAMPLE = getattr(Image, 'Resampling', Image).LANCZOS
+
+
+def decode_base64(data):
+    """Декодирование base64 по частям во временный файл"""
+    # Переводы строк и пробелы сдвинули бы группы по 4 символа в кусках
+    data = ''.join(data.split())
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        output.write(base64.b64decode(
+            data[start:start + BASE64_CHUNK_SIZE]
+        ))
+    output.seek(0)
+    return output
+
+
+def prepare_image(image):
+    """Поворот по EXIF, приведение к RGB или, с прозрачностью, к RGBA
+    и удаление метаданных"""
+    image = ImageOps.exif_transpose(image)
+    transparent = (
+        image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    )
+    image = image.convert('RGBA' if transparent else 'RGB')
+    # Без info при сохранении не переносятся EXIF и ICC
+    image.info = {}
+    return image
+
+
+def flatten(image):
+    """Прозрачность на белом фоне: для форматов без альфа-канала"""
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def encode_image(image, extension):
+    image_format, options = IMAGE_FORMATS[extension]
+    if image.mode == 'RGBA' and image_format == 'JPEG':
+        image = flatten(image)
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def normalize_upload(file, name='image'):
+    """Оригинал для хранения: не больше ORIGINAL_SIZE, без EXIF.
+
+    PNG и WebP сохраняются в своем формате вместе с прозрачностью,
+    остальные форматы - в JPEG.
+    """
+    with Image.open(file) as source:
+        extension = ORIGINAL_FORMATS.get(source.format, 'jpeg')
+        image = prepare_image(source)
+    image.thumbnail(ORIGINAL_SIZE, RESAMPLE)
+    return ContentFile(
+        encode_image(image, extension),
+        name=f'{name}.{FILE_EXTENSIONS.get(extension, extension)}'
+    )
+
+
+def get_rendition_formats():
+    return [
+        extension for extension in RENDITION_FORMATS
+        if extension != 'webp' or features.check('webp')
+    ]
+
+
+def generate_renditions(image_field):
+    """Сохранить варианты изображения, вернуть их пути в хранилище.
+
+    Результат: {'thumbnail': {'webp': path, 'jpeg': path}, ...}
+    """
+    stem = os.path.splitext(os.path.basename(image_field.name))[0]
+    with image_field.open('rb') as file, Image.open(file) as source:
+        image = prepare_image(source)
+
+    renditions = {}
+    for name, size in RENDITIONS.items():
+        rendition = image.copy()
+        rendition.thumbnail(size, RESAMPLE)
+        renditions[name] = {}
+        for extension in get_rendition_formats():
+            path = default_storage.save(
+                f'{RENDITIONS_DIR}/{stem}_{name}.{extension}',
+                File(BytesIO(encode_image(rendition, extension)))
+            )
+            renditions[name][extension] = path
+    return renditions
+
+
+def schedule_recipe_renditions(recipe):
+    """Варианты нового изображения рецепта до его сохранения: сразу
+    или фоновой задачей после фиксации транзакции (по настройке).
+
+    Сделанные сразу варианты попадают в image_renditions и пишутся тем
+    же сохранением рецепта, без отдельного UPDATE.
+    """
+    if not settings.IMAGE_RENDITIONS_IN_BACKGROUND:
+        set_recipe_renditions(recipe)
+        return
+    transaction.on_commit(
+        lambda: enqueue('recipe_renditions', recipe_id=recipe.pk)
+    )
+
+
+def get_rendition_paths(renditions):
+    return {
+        path for formats in (renditions or {}).values()
+        for path in formats.values()
+    }
+
+
+def set_recipe_renditions(recipe):
+    """Пересоздать варианты изображения рецепта, не сохраняя рецепт.
+
+    Еще не сохраненное изображение сначала пишется в хранилище, как при
+    сохранении рецепта. Файлы прежних вариантов удаляются после
+    фиксации транзакции, чтобы при ее откате рецепт не ссылался
+    на удаленные файлы.
+    """
+    if not recipe.image:
+        return
+    recipe._meta.get_field('image').pre_save(recipe, False)
+    old_paths = get_rendition_paths(recipe.image_renditions)
+    recipe.image_renditions = generate_renditions(recipe.image)
+    old_paths -= get_rendition_paths(recipe.image_renditions)
+    if old_paths:
+        transaction.on_commit(lambda: delete_files(old_paths))
+
+
+def update_recipe_renditions(recipe):
+    """Пересоздать и сохранить варианты изображения рецепта"""
+    if not recipe.image:
+        return
+    set_recipe_renditions(recipe)
+    recipe.save(update_fields=['image_renditions'])
+
+
+def delete_files(paths):
+    for path in paths:
+        default_storage.delete(path)
@@ -0,0 +1,25 @@
+from app.models import Recipe
+
+
+def locked_recipes():
+    """Рецепты, строки которых блокируются при чтении (см. lock_recipes).
+
+    Блокируются только строки рецептов, не связанных через select_related.
+    """
+    return Recipe.objects.select_for_update(no_key=True, of=('self',))
+
+
+def lock_recipes(recipe_ids):
+    """Заблокировать строки рецептов до конца транзакции, вернуть id
+    найденных рецептов.
+
+    Берут блокировку все, кто меняет корзины, избранное или состав
+    рецептов: добавление рецепта в корзину читает его состав, а изменение
+    состава - держателей корзин, и без общей блокировки параллельная пара
+    таких запросов оставляет список покупок неверным. Порядок блокировок
+    везде один: сначала рецепты (по id), затем пользователи.
+    FOR NO KEY UPDATE не мешает вставке строк со ссылкой на рецепт.
+    """
+    return list(locked_recipes().filter(pk__in=recipe_ids).order_by(
+        'pk'
+    ).values_list('pk', flat=True))
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from app.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    help = 'Пересборка лент подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, nargs='+', dest='users',
+            help='Пересобрать ленты только указанных пользователей (id)'
+        )
+
+    def handle(self, *args, **options):
+        rebuild_feeds(options['users'])
+        self.stdout.write(self.style.SUCCESS('Ленты подписок пересобраны'))
@@ -0,0 +1,100 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+
+from app.feed import rebuild_feeds
+from app.models import Ingredient, Recipe, Tag
+from app.shopping_list import rebuild_shopping_lists
+from app.synthetic import SyntheticDataset, insert_rows
+from app.versions import bump_versions
+from users.models import User
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        'Синтетические данные для нагрузочных тестов: пользователи, '
+        'рецепты с ингредиентами и тегами, подписки, избранное и корзины. '
+        'Ингредиенты и теги берутся из базы (manage.py upmodels)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=float, default=1,
+            help='Масштаб: на единицу 1000 пользователей и ~10 000 рецептов'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора: одинаковое зерно - одинаковые данные'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Строк в одной пачке'
+        )
+        parser.add_argument(
+            '--password', default='gendata',
+            help='Пароль всех созданных пользователей'
+        )
+
+    def handle(self, *args, **options):
+        seed = options['seed']
+        if User.objects.filter(username__startswith=f'gen{seed}_').exists():
+            raise CommandError(
+                f'Данные с зерном {seed} уже созданы, укажите другое --seed'
+            )
+        ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError(
+                'Нет ингредиентов: загрузите их командой upmodels'
+            )
+        dataset = SyntheticDataset(
+            seed, options['scale'], ingredient_ids,
+            list(Tag.objects.order_by('pk').values_list('pk', flat=True)),
+            self.get_next_id(User), self.get_next_id(Recipe),
+            make_password(options['password'])
+        )
+        started = time.monotonic()
+        total = 0
+        for title, model, names, rows in dataset.tables():
+            total += self.load(title, model, names, rows,
+                               options['batch_size'])
+
+        # Строки вставлены с явными id
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        # Сигналы не вызывались: производные данные пересчитываются
+        self.stdout.write('Пересчет счетчиков, списков покупок и лент')
+        call_command('recount', stdout=self.stdout)
+        rebuild_shopping_lists()
+        rebuild_feeds()
+        bump_versions('recipes', 'users')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано строк: {total} за {time.monotonic() - started:.0f} с'
+        ))
+
+    def get_next_id(self, model):
+        return (model.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+    def load(self, title, model, names, rows, batch_size):
+        started = time.monotonic()
+        count = 0
+        for inserted in insert_rows(model, names, rows, batch_size):
+            count += inserted
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'  {title}: {count}, '
+                f'{count / max(elapsed, 1e-6):.0f} строк/с'
+            )
+        self.stdout.write(f'{title}: {count}')
+        return count
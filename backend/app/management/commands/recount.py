@@ -0,0 +1,74 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from app.models import FavoriteRecipe, Recipe
+from app.versions import bump_versions
+from users.models import User
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def count_subquery(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+def recount(queryset, field, count, batch_size):
+    """Исправить счетчик field там, где он разошелся с count.
+
+    Строки обходятся диапазонами id по batch_size, каждый диапазон -
+    отдельная транзакция: блокируются только исправляемые строки
+    и ненадолго. Возвращает число исправленных строк.
+    """
+    bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return 0
+    updated = 0
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        with transaction.atomic():
+            updated += queryset.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).exclude(**{field: count}).update(**{field: count})
+    return updated
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет счетчиков избранного у рецептов и рецептов у авторов: '
+        'исправляются только разошедшиеся'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Строк (диапазон id) в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = recount(
+            Recipe.objects.all(), 'favorites_count',
+            count_subquery(FavoriteRecipe.objects.all(), 'recipe'),
+            batch_size
+        )
+        users = recount(
+            User.objects.all(), 'recipes_count',
+            count_subquery(Recipe.objects.all(), 'author'), batch_size
+        )
+        scopes = [
+            scope for scope, updated in (
+                ('favorites', recipes), ('users', users)
+            ) if updated
+        ]
+        if scopes:
+            bump_versions(*scopes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики исправлены: рецептов - {recipes},'
+            f' пользователей - {users}'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+
+from app.images import update_recipe_renditions
+from app.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создание уменьшенных вариантов изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только для рецептов без вариантов изображения'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if options['missing']:
+            recipes = recipes.filter(image_renditions={})
+        processed = 0
+        for recipe in recipes.iterator():
+            try:
+                update_recipe_renditions(recipe)
+            except OSError as error:
+                self.stderr.write(f'Рецепт {recipe.pk}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {processed}'
+        ))
@@ -0,0 +1,55 @@
+from itertools import islice
+
+from django.core.management import BaseCommand
+
+from app.shopping_list import (find_broken_shopping_lists,
+                               rebuild_shopping_lists)
+from users.models import User
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверка и пересборка сводных списков покупок. Пользователи '
+        'обходятся пачками, в памяти - списки только одной пачки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересобрать списки пользователей с расхождениями'
+        )
+        parser.add_argument(
+            '--user', type=int, nargs='+', dest='users',
+            help='Проверять только указанных пользователей (id)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Пользователей в одной пачке'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or User.objects.order_by(
+            'pk'
+        ).values_list('pk', flat=True).iterator()
+        user_ids = iter(user_ids)
+        broken = []
+        while True:
+            batch = list(islice(user_ids, options['batch_size']))
+            if not batch:
+                break
+            found = find_broken_shopping_lists(batch)
+            if found and options['rebuild']:
+                rebuild_shopping_lists(found)
+            broken.extend(found)
+
+        if not broken:
+            self.stdout.write(self.style.SUCCESS('Списки покупок согласованы'))
+            return
+        self.stdout.write(self.style.WARNING(
+            'Расхождения у пользователей: '
+            + ', '.join(str(user_id) for user_id in broken)
+        ))
+        if options['rebuild']:
+            self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
@@ -1,27 +1,165 @@
-import csv
+import os
+import time
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core import serializers
+from django.core.management import BaseCommand, call_command
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
-from app.models import Ingredient
+from app.catalog import (get_ingredients, iter_source, upsert_ingredients,
+                         upsert_tag)
+from app.feed import rebuild_feeds
+from app.search import ingredient_index
+from app.shopping_list import rebuild_shopping_lists
+from app.versions import bump_versions
 
-TABLES = {
-    Ingredient: 'ingredients.csv',
+DEFAULT_SOURCES = ('ingredients.csv',)
+DEFAULT_BATCH_SIZE = 5000
+# Служебные данные конкретной установки, их в фикстурах пропускаем
+EXCLUDED_MODELS = {
+    'admin.logentry', 'auth.permission', 'contenttypes.contenttype',
+    'sessions.session',
 }
 
 
 class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
-        for model, csv_files in TABLES.items():
-            with open(
-                f'{settings.BASE_DIR}/data/{csv_files}',
-                'r',
-                encoding='utf-8'
-            ) as csv_file:
-                reader = csv.reader(csv_file)
-                model.objects.bulk_create(
-                    model(
-                        name=data[0], measurement_unit=data[1]
-                    ) for data in reader
-                )
+    help = (
+        'Загрузка ингредиентов (CSV/JSON), тегов и фикстур. Повторный '
+        'запуск добавляет новые ингредиенты и обновляет единицы измерения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources', nargs='*', default=DEFAULT_SOURCES,
+            help='Файлы: CSV с ингредиентами, JSON со списком ингредиентов '
+                 'или фикстура (пути относительно data/ тоже подходят)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Строк в одной пачке'
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.ingredient_ids = {}
+        self.tag_ids = {}
+        self.loaded_models = set()
+        for source in options['sources']:
+            self.load_source(self.get_path(source))
+
+        ingredient_index.invalidate()
+        bump_versions('ingredients', 'tags', 'recipes', 'users')
+        if self.loaded_models:
+            # Фикстуры сохраняются без сигналов: производные данные
+            # пересчитываются целиком
+            call_command('recount', stdout=self.stdout)
+            rebuild_shopping_lists()
+            rebuild_feeds()
         self.stdout.write(self.style.SUCCESS('Все данные загружены'))
+
+    def get_path(self, source):
+        if os.path.exists(source):
+            return source
+        return os.path.join(settings.BASE_DIR, 'data', source)
+
+    def load_source(self, path):
+        self.stdout.write(f'Загрузка {path}')
+        self.units = {}
+        self.fixture_ingredients = {}
+        self.objects = []
+        self.processed = self.created = self.updated = 0
+        self.started = time.monotonic()
+
+        with open(path, encoding='utf-8', newline='') as file:
+            with transaction.atomic():
+                with connection.constraint_checks_disabled():
+                    for item in iter_source(file, path):
+                        self.load_item(item)
+                    self.flush_ingredients()
+                    self.flush_objects()
+                self.check_objects()
+
+    def load_item(self, item):
+        model = item.get('model')
+        if model is None or model == 'app.ingredient':
+            self.add_ingredient(item.get('fields', item), item.get('pk'))
+        elif model == 'app.tag':
+            self.tag_ids[item['pk']] = upsert_tag(item['fields'])
+        elif model not in EXCLUDED_MODELS:
+            # Ссылки на ингредиенты должны быть уже загружены
+            self.flush_ingredients()
+            self.objects.append(self.remap(item))
+            if len(self.objects) >= self.batch_size:
+                self.flush_objects()
+
+    def add_ingredient(self, fields, fixture_pk):
+        name = fields['name'].strip()
+        # Повтор названия: остается последняя единица измерения
+        self.units[name] = fields['measurement_unit'].strip()
+        if fixture_pk is not None:
+            self.fixture_ingredients.setdefault(name, []).append(fixture_pk)
+        if len(self.units) >= self.batch_size:
+            self.flush_ingredients()
+
+    def flush_ingredients(self):
+        if not self.units:
+            return
+        created, updated = upsert_ingredients(self.units)
+        self.created += created
+        self.updated += updated
+        self.processed += len(self.units)
+        # id из фикстуры -> id в базе (повторы указывают на одну строку)
+        for name, (pk, _) in get_ingredients(self.fixture_ingredients).items():
+            for fixture_pk in self.fixture_ingredients[name]:
+                self.ingredient_ids[fixture_pk] = pk
+        self.units = {}
+        self.fixture_ingredients = {}
+        self.report()
+
+    def remap(self, item):
+        fields = item['fields']
+        if item['model'] == 'app.recipeingredient':
+            fields['ingredient'] = self.ingredient_ids.get(
+                fields['ingredient'], fields['ingredient']
+            )
+        elif item['model'] == 'app.recipe':
+            fields['tags'] = [
+                self.tag_ids.get(pk, pk) for pk in fields.get('tags', [])
+            ]
+        return item
+
+    def flush_objects(self):
+        if not self.objects:
+            return
+        for obj in serializers.deserialize(
+            'python', self.objects, ignorenonexistent=True
+        ):
+            obj.save()
+            self.loaded_models.add(type(obj.object))
+        self.processed += len(self.objects)
+        self.objects = []
+        self.report()
+
+    def check_objects(self):
+        """Проверка ссылок и сдвиг последовательностей, как в loaddata"""
+        if not self.loaded_models:
+            return
+        connection.check_constraints(table_names=[
+            model._meta.db_table for model in self.loaded_models
+        ])
+        # Объекты фикстур сохранены с явными id
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), self.loaded_models
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'  записей: {self.processed}, ингредиентов добавлено: '
+            f'{self.created}, обновлено: {self.updated}, '
+            f'{self.processed / max(elapsed, 1e-6):.0f} записей/с'
+        )
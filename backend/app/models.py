@@ -51,6 +51,9 @@ class Recipe(models.Model):
         ]
     )
     image = models.ImageField('Изображение', upload_to='recipes/')
+    image_renditions = models.JSONField(
+        'Варианты изображения', default=dict, blank=True, editable=False
+    )
     tags = models.ManyToManyField(
         Tag, related_name='recipes', verbose_name='Теги'
     )
@@ -58,11 +61,20 @@ class Recipe(models.Model):
         Ingredient, related_name='recipes', verbose_name='Ингридиенты',
         through='RecipeIngredient'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Количество добавлений в избранное', default=0, editable=False
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-id',)
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx'
+            )
+        ]
 
     def __str__(self):
         return f'Рецепт - {self.name} | Автор рецепта - {self.author.username}'
@@ -153,3 +165,94 @@ class ShoppingCart(models.Model):
             f'Пользователь {self.user} | Рецепт {self.recipe}'
             f' от {self.recipe.name}'
         )
+
+
+class ShoppingListItem(models.Model):
+    """Сводный список покупок пользователя.
+
+    Хранит суммарное количество каждого ингредиента из всех рецептов
+    корзины и обновляется в тех же транзакциях, что и сама корзина.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.IntegerField('Общее количество', default=0)
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return (f'Пользователь {self.user} | {self.ingredient.name} -'
+                f' {self.total_amount}')
+
+
+class FeedEntry(models.Model):
+    """Лента подписок: рецепты авторов, на которых подписан пользователь.
+
+    Записи добавляются при публикации рецепта всем подписчикам автора,
+    при подписке - по всем рецептам автора, и удаляются при отписке.
+    Лента читается одним проходом по индексу (user, recipe).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', 'author'], name='feed_author_idx')
+        ]
+
+    def __str__(self):
+        return f'Лента {self.user} | {self.recipe}'
+
+
+class DataVersion(models.Model):
+    """Версия области данных для ETag и ключей кэша (app/versions.py)"""
+    scope = models.CharField('Область', max_length=100, primary_key=True)
+    version = models.BigIntegerField('Версия')
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.scope} - {self.version}'
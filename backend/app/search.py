@@ -0,0 +1,204 @@
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import (BooleanField, Case, FloatField, IntegerField, Q,
+                              Value, When)
+from django.db.models.expressions import RawSQL
+
+from app.models import Ingredient, Recipe
+
+# Полнотекстовый поиск рецептов: конфигурация PostgreSQL и таблица FTS5
+# для SQLite. Индексов нет в миграциях, они создаются после migrate
+SEARCH_CONFIG = 'russian'
+RECIPE_FTS_TABLE = 'app_recipe_fts'
+# Вес названия относительно описания в bm25 (SQLite)
+FTS_NAME_WEIGHT = 10.0
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Используется там, где нет триграммного индекса (SQLite). Названия
+    хранятся отсортированными, поэтому совпадения по префиксу находятся
+    бинарным поиском, а совпадения по подстроке - одним проходом без
+    обращения к базе данных.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._names = []
+        self._ids = []
+        self._built_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._built_at = None
+
+    def _load(self):
+        with self._lock:
+            if (self._built_at is None
+                    or time.monotonic() - self._built_at > self.ttl):
+                entries = sorted(
+                    (name.lower(), pk) for pk, name
+                    in Ingredient.objects.values_list('pk', 'name')
+                )
+                self._names = [name for name, _ in entries]
+                self._ids = [pk for _, pk in entries]
+                self._built_at = time.monotonic()
+            return self._names, self._ids
+
+    def search(self, query, limit):
+        """Список id: сначала совпадения по префиксу, затем по подстроке"""
+        names, ids = self._load()
+        query = query.lower()
+        result = []
+
+        position = bisect.bisect_left(names, query)
+        while (position < len(names) and len(result) < limit
+               and names[position].startswith(query)):
+            result.append(ids[position])
+            position += 1
+
+        for name, pk in zip(names, ids):
+            if len(result) >= limit:
+                break
+            if query in name and not name.startswith(query):
+                result.append(pk)
+        return result
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_SEARCH_INDEX_TTL)
+
+
+def search_ingredients(queryset, query, limit=None):
+    """Ранжированный поиск ингредиентов по названию.
+
+    Сначала идут совпадения по началу названия (без учета регистра),
+    затем совпадения по подстроке. Количество результатов ограничено.
+    """
+    limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+
+    if connection.vendor == 'postgresql':
+        return queryset.filter(name__icontains=query).annotate(
+            search_rank=Case(
+                When(name__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('search_rank', 'name')[:limit]
+
+    ids = ingredient_index.search(query, limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).order_by(Case(
+        *[When(pk=pk, then=Value(position))
+          for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    ))
+
+
+def create_recipe_search_index(connection):
+    """Полнотекстовый индекс рецептов по названию и описанию.
+
+    PostgreSQL: вычисляемый столбец tsvector (название важнее описания)
+    с GIN-индексом, его обновляет сама база при любой записи. SQLite:
+    таблица FTS5 с триггерами, после миграций она перестраивается,
+    потому что пересоздание таблицы рецептов удаляет триггеры.
+    """
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    if connection.vendor == 'postgresql':
+        statements = [
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector "
+            f"tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+            f"coalesce(name, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', "
+            f"coalesce(text, '')), 'B')) STORED",
+            f'CREATE INDEX IF NOT EXISTS app_recipe_search_vector '
+            f'ON {table} USING gin (search_vector)',
+        ]
+    elif connection.vendor == 'sqlite':
+        fts = RECIPE_FTS_TABLE
+        delete = (
+            f"INSERT INTO {fts} ({fts}, rowid, name, text) "
+            f"VALUES ('delete', old.id, old.name, old.text);"
+        )
+        insert = (
+            f'INSERT INTO {fts} (rowid, name, text) '
+            f'VALUES (new.id, new.name, new.text);'
+        )
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"name, text, content={table}, content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')",
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT '
+            f'ON {table} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE '
+            f'ON {table} BEGIN {delete} END',
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE '
+            f'OF name, text ON {table} BEGIN {delete} {insert} END',
+            f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+        ]
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def get_fts_query(query):
+    """Запрос FTS5 из слов пользователя: все слова, по началу основы.
+
+    В SQLite нет стемминга для русского языка, поэтому окончания длинных
+    слов отбрасываются: "курицей" найдет и "курица".
+    """
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(
+        '"{}"*'.format(word[:max(4, len(word) - 2)]) for word in words
+    )
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос: самые релевантные, затем новые.
+
+    Релевантность только сортирует выдачу и не попадает в SELECT, поэтому
+    count() пагинации остается простым COUNT. Остальные фильтры queryset
+    сохраняются.
+    """
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    if connection.vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        matches = RawSQL(
+            f'{table}.search_vector @@ {tsquery}', [query],
+            output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f'ts_rank({table}.search_vector, {tsquery})', [query],
+            output_field=FloatField()
+        )
+    elif connection.vendor == 'sqlite':
+        query = get_fts_query(query)
+        if not query:
+            return queryset.none()
+        fts = RECIPE_FTS_TABLE
+        matches = RawSQL(
+            f'{table}.id IN (SELECT rowid FROM {fts} '
+            f'WHERE {fts} MATCH %s)', [query],
+            output_field=BooleanField()
+        )
+        # bm25 тем меньше, чем лучше совпадение
+        rank = RawSQL(
+            f'(SELECT -bm25({fts}, {FTS_NAME_WEIGHT}, 1.0) FROM {fts} '
+            f'WHERE {fts} MATCH %s AND rowid = {table}.id)', [query],
+            output_field=FloatField()
+        )
+    else:
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).order_by('-id')
+    return queryset.filter(matches).order_by(rank.desc(), '-id')
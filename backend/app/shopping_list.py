@@ -0,0 +1,176 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from app.locks import lock_recipes
+from app.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+from users.models import User
+
+
+def get_recipe_amounts(recipe):
+    """Количество каждого ингредиента в рецепте: {ingredient_id: amount}"""
+    return dict(RecipeIngredient.objects.filter(
+        recipe=recipe
+    ).values_list('ingredient_id', 'amount'))
+
+
+def apply_shopping_list_changes(user_ids, changes):
+    """Прибавить изменения {ingredient_id: delta} к спискам покупок.
+
+    Строки пользователей блокируются, чтобы параллельные запросы одного
+    пользователя не теряли обновления. Позиции с нулевым количеством
+    удаляются. Рецепты, по которым посчитаны изменения, вызывающий код
+    блокирует раньше (app.locks.lock_recipes).
+    """
+    changes = {pk: delta for pk, delta in changes.items() if delta}
+    user_ids = sorted(set(user_ids))
+    if not user_ids or not changes:
+        return
+
+    list(User.objects.select_for_update().filter(
+        pk__in=user_ids
+    ).order_by('pk').values_list('pk', flat=True))
+
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=changes
+    )
+    existing = set(items.values_list('user_id', 'ingredient_id'))
+    if existing:
+        items.update(total_amount=F('total_amount') + Case(
+            *[When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in changes.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+    ShoppingListItem.objects.bulk_create([
+        ShoppingListItem(user_id=user_id, ingredient_id=pk,
+                         total_amount=delta)
+        for user_id in user_ids
+        for pk, delta in changes.items()
+        if delta > 0 and (user_id, pk) not in existing
+    ])
+    # Обнулиться могут только позиции, количество которых уменьшилось
+    if any(delta < 0 for delta in changes.values()):
+        items.filter(total_amount__lte=0).delete()
+
+
+def get_recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов"""
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).values_list('ingredient_id', 'total'))
+
+
+def add_recipe_to_shopping_list(user, recipe):
+    apply_shopping_list_changes([user.pk], get_recipe_amounts(recipe))
+
+
+def remove_recipe_from_shopping_list(user, recipe):
+    apply_shopping_list_changes([user.pk], {
+        pk: -amount for pk, amount in get_recipe_amounts(recipe).items()
+    })
+
+
+def add_recipes_to_shopping_list(user, recipe_ids):
+    apply_shopping_list_changes([user.pk], get_recipes_amounts(recipe_ids))
+
+
+def remove_recipes_from_shopping_list(user, recipe_ids):
+    apply_shopping_list_changes([user.pk], {
+        pk: -amount
+        for pk, amount in get_recipes_amounts(recipe_ids).items()
+    })
+
+
+def remove_recipe_from_all_shopping_lists(recipe):
+    """Убрать рецепт из списков всех пользователей, у кого он в корзине"""
+    lock_recipes([recipe.pk])
+    apply_shopping_list_changes(
+        ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True),
+        {pk: -amount for pk, amount in get_recipe_amounts(recipe).items()}
+    )
+
+
+def recipe_ingredients_changed(recipe, old_amounts, new_amounts):
+    """Учесть изменение состава рецепта в списках покупок.
+
+    Рецепт блокируется (lock_recipes) до чтения old_amounts: тогда
+    держатели корзин, добавившие рецепт параллельно, уже учтены здесь
+    или увидят новый состав.
+    """
+    changes = {
+        pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+        for pk in set(old_amounts) | set(new_amounts)
+    }
+    apply_shopping_list_changes(
+        ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True),
+        changes
+    )
+
+
+def calculate_shopping_lists(user_ids=None):
+    """Списки покупок, посчитанные заново по корзинам.
+
+    Возвращает {user_id: {ingredient_id: total_amount}}.
+    """
+    # Одно условие на корзину: второй filter() по связи "многие" добавил
+    # бы второе соединение с корзинами и умножил суммы
+    if user_ids is None:
+        cart = {'recipe__cart__isnull': False}
+    else:
+        cart = {'recipe__cart__user__in': user_ids}
+    queryset = RecipeIngredient.objects.filter(**cart)
+    result = defaultdict(dict)
+    for user_id, ingredient_id, total in queryset.values(
+        'recipe__cart__user', 'ingredient'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).values_list('recipe__cart__user', 'ingredient', 'total_amount'):
+        result[user_id][ingredient_id] = total
+    return result
+
+
+def get_stored_shopping_lists(user_ids=None):
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    result = defaultdict(dict)
+    for user_id, ingredient_id, total in queryset.values_list(
+        'user_id', 'ingredient_id', 'total_amount'
+    ):
+        result[user_id][ingredient_id] = total
+    return result
+
+
+def find_broken_shopping_lists(user_ids):
+    """id пользователей, чьи сохраненные списки разошлись с корзинами"""
+    expected = calculate_shopping_lists(user_ids)
+    stored = get_stored_shopping_lists(user_ids)
+    return sorted(
+        user_id for user_id in set(expected) | set(stored)
+        if expected.get(user_id, {}) != stored.get(user_id, {})
+    )
+
+
+@transaction.atomic()
+def rebuild_shopping_lists(user_ids=None, batch_size=1000):
+    """Пересоздать сохраненные списки покупок по корзинам"""
+    expected = calculate_shopping_lists(user_ids)
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    queryset.delete()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=pk,
+                          total_amount=total)
+         for user_id, amounts in expected.items()
+         for pk, total in amounts.items()),
+        batch_size=batch_size
+    )
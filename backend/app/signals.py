@@ -0,0 +1,176 @@
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_migrate, post_save, pre_delete)
+from django.dispatch import receiver
+
+from app.feed import backfill_feed, schedule_fan_out, trim_feed
+from app.models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
+                        ShoppingCart, Tag)
+from app.search import create_recipe_search_index, ingredient_index
+from app.shopping_list import remove_recipe_from_all_shopping_lists
+from app.versions import bump_versions
+from users.models import Follow, User
+
+# Поля пользователя в данных автора рецепта (версия users)
+AUTHOR_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, using, **kwargs):
+    """Индексы поиска: полнотекстовый для рецептов и триграммный
+    для ингредиентов (только PostgreSQL)"""
+    connection = connections[using]
+    if sender.name != 'app':
+        return
+    create_recipe_search_index(connection)
+    if connection.vendor != 'postgresql':
+        return
+
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS app_ingredient_name_trgm '
+            f'ON {table} USING gin (UPPER(name) gin_trgm_ops)'
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    remove_recipe_from_all_shopping_lists(instance)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def increase_favorites_count(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            favorites_count=F('favorites_count') + 1
+        )
+        # Списки с сортировкой по числу добавлений в избранное
+        bump_versions('favorites')
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def decrease_favorites_count(sender, instance, **kwargs):
+    Recipe.objects.filter(
+        pk=instance.recipe_id, favorites_count__gt=0
+    ).update(favorites_count=F('favorites_count') - 1)
+    bump_versions('favorites')
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.author_id, recipes_count__gt=0
+    ).update(recipes_count=F('recipes_count') - 1)
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_feeds(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        schedule_fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_follower_feed(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        backfill_feed(instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_follower_feed(sender, instance, **kwargs):
+    trim_feed(instance.follower_id, instance.following_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, created=False, **kwargs):
+    # Ответов с ETag по еще не созданному рецепту не было: его область
+    # понадобится с первым изменением
+    if created:
+        bump_versions('recipes')
+    else:
+        bump_versions('recipes', f'recipe:{instance.pk}')
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def bump_recipe_ingredients_version(sender, instance, **kwargs):
+    bump_versions('recipes', f'recipe:{instance.recipe_id}')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_tags_version(sender, instance, reverse, pk_set, **kwargs):
+    recipe_ids = (pk_set or ()) if reverse else (instance.pk,)
+    bump_versions('recipes', *(f'recipe:{pk}' for pk in recipe_ids))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def bump_viewer_version(sender, instance, **kwargs):
+    # Флаги is_favorited и is_in_shopping_cart зависят от пользователя
+    bump_versions(f'viewer:{instance.user_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follower_version(sender, instance, **kwargs):
+    bump_versions(f'viewer:{instance.follower_id}')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_versions('tags')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_versions('ingredients')
+
+
+def get_author_data(user):
+    # Без обращения к отложенным полям: они дали бы лишний запрос
+    return tuple(user.__dict__.get(field) for field in AUTHOR_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_author_data(sender, instance, **kwargs):
+    instance._author_data = get_author_data(instance)
+
+
+@receiver(post_save, sender=User)
+def bump_users_version(sender, instance, created, update_fields=None,
+                       **kwargs):
+    # Вход, смена пароля и счетчики не меняют данные авторов в рецептах,
+    # а у нового пользователя еще нет рецептов
+    if created or (update_fields is not None
+                   and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    data = get_author_data(instance)
+    if data != instance._author_data:
+        instance._author_data = data
+        bump_versions('users')
+
+
+@receiver(post_delete, sender=User)
+def bump_users_version_on_delete(sender, **kwargs):
+    bump_versions('users')
@@ -0,0 +1,231 @@
+import csv
+import random
+from io import StringIO
+from itertools import accumulate, islice
+
+from django.db import connection
+from django.utils import timezone
+
+from app.models import FavoriteRecipe, Recipe, RecipeIngredient, ShoppingCart
+from users.models import Follow, User
+
+# Средние значения на пользователя; распределения - степенные
+RECIPES_PER_USER = 10
+FOLLOWS_PER_USER = 10
+FAVORITES_PER_USER = 15
+CART_PER_USER = 3
+INGREDIENTS_PER_RECIPE = (5, 30)
+TAGS_PER_RECIPE = (1, 3)
+# Для COPY: пустая строка остается строкой, NULL - отдельная метка
+NULL = '\\N'
+
+FIRST_NAMES = (
+    'Анна', 'Мария', 'Елена', 'Ольга', 'Ирина', 'Иван', 'Петр', 'Алексей',
+    'Дмитрий', 'Сергей', 'Никита', 'Полина', 'Андрей', 'Татьяна', 'Максим',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+    'Михайлов', 'Новиков', 'Морозов', 'Волков', 'Лебедев', 'Козлов',
+)
+DISHES = (
+    'Борщ', 'Суп', 'Салат', 'Пирог', 'Омлет', 'Плов', 'Каша', 'Рагу',
+    'Запеканка', 'Блины', 'Котлеты', 'Паста', 'Сырники', 'Гуляш', 'Пицца',
+)
+DETAILS = (
+    'с курицей', 'с грибами', 'с сыром', 'с яблоками', 'с говядиной',
+    'овощной', 'по-домашнему', 'острый', 'летний', 'с тыквой', 'с рыбой',
+)
+STEPS = (
+    'Нарезать овощи кубиками.', 'Обжарить на среднем огне до золотистого '
+    'цвета.', 'Добавить специи и перемешать.', 'Тушить под крышкой.',
+    'Запекать в разогретой духовке.', 'Посолить и поперчить по вкусу.',
+    'Подавать горячим со свежей зеленью.', 'Дать настояться перед подачей.',
+)
+
+
+def copy_rows(model, names, rows):
+    """PostgreSQL: COPY строк в таблицу модели"""
+    fields = [model._meta.get_field(name) for name in names]
+    data = StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([
+            NULL if value is None else value for value in (
+                field.get_db_prep_save(value, connection)
+                for field, value in zip(fields, row)
+            )
+        ])
+    data.seek(0)
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN "
+            f"WITH (FORMAT csv, NULL '{NULL}')", data
+        )
+
+
+def insert_rows(model, names, rows, batch_size):
+    """Вставка строк пачками, отдает размер каждой пачки.
+
+    В PostgreSQL - через COPY, в остальных СУБД - bulk_create.
+    Сигналы моделей не вызываются.
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        if connection.vendor == 'postgresql':
+            copy_rows(model, names, batch)
+        else:
+            model.objects.bulk_create(
+                [model(**dict(zip(names, row))) for row in batch]
+            )
+        yield len(batch)
+
+
+def zipf_weights(size, exponent=1.0):
+    """Накопленные веса: k-й по популярности встречается в ~1/k^s раз"""
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)
+    ))
+
+
+class SyntheticDataset:
+    """Детерминированный набор данных для нагрузочных тестов.
+
+    Одинаковые seed, scale, справочники и начальные id дают одинаковые
+    данные. На единицу scale - 1000 пользователей и около 10 000 рецептов.
+    Таблицы отдаются по очереди методом tables(): строки следующей
+    таблицы строятся по id, накопленным при чтении предыдущих.
+    """
+
+    def __init__(self, seed, scale, ingredient_ids, tag_ids,
+                 first_user_id, first_recipe_id, password):
+        self.seed = seed
+        self.users = max(int(1000 * scale), 1)
+        self.ingredient_ids = ingredient_ids
+        self.tag_ids = tag_ids
+        self.user_ids = range(first_user_id, first_user_id + self.users)
+        self.first_recipe_id = first_recipe_id
+        self.password = password
+        self.recipe_ids = []
+        self.author_ids = []
+
+    def get_random(self, table):
+        # Свой генератор на таблицу: данные не зависят от порядка чтения
+        return random.Random(f'{self.seed}:{table}')
+
+    def power_count(self, rng, mean, limit):
+        """Степенное распределение (Парето, a = 1.5) со средним ~mean"""
+        return min(int((rng.paretovariate(1.5) - 1) * mean / 2), limit)
+
+    def tables(self):
+        """(название, модель, поля, строки) в порядке вставки"""
+        yield 'пользователи', User, (
+            'id', 'username', 'email', 'first_name', 'last_name', 'password',
+            'is_superuser', 'is_staff', 'is_active', 'date_joined',
+            'recipes_count',
+        ), self.user_rows()
+        yield 'рецепты', Recipe, (
+            'id', 'author_id', 'name', 'text', 'cooking_time', 'image',
+            'image_renditions', 'favorites_count',
+        ), self.recipe_rows()
+        yield 'ингредиенты рецептов', RecipeIngredient, (
+            'recipe_id', 'ingredient_id', 'amount',
+        ), self.recipe_ingredient_rows()
+        if self.tag_ids:
+            yield 'теги рецептов', Recipe.tags.through, (
+                'recipe_id', 'tag_id',
+            ), self.recipe_tag_rows()
+        yield 'подписки', Follow, (
+            'follower_id', 'following_id',
+        ), self.follow_rows()
+        yield 'избранное', FavoriteRecipe, (
+            'user_id', 'recipe_id',
+        ), self.user_recipe_rows('favorites', FAVORITES_PER_USER, 2000)
+        yield 'корзины', ShoppingCart, (
+            'user_id', 'recipe_id',
+        ), self.user_recipe_rows('cart', CART_PER_USER, 30)
+
+    def user_rows(self):
+        rng = self.get_random('users')
+        now = timezone.now()
+        for user_id in self.user_ids:
+            username = f'gen{self.seed}_{user_id}'
+            yield (
+                user_id, username, f'{username}@example.com',
+                rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                self.password, False, False, True, now, 0,
+            )
+
+    def recipe_rows(self):
+        rng = self.get_random('recipes')
+        recipe_id = self.first_recipe_id
+        for user_id in self.user_ids:
+            count = self.power_count(rng, RECIPES_PER_USER, 500)
+            if count:
+                self.author_ids.append(user_id)
+            for number in range(1, count + 1):
+                name = f'{rng.choice(DISHES)} {rng.choice(DETAILS)}'
+                text = ' '.join(rng.sample(STEPS, rng.randint(2, 5)))
+                self.recipe_ids.append(recipe_id)
+                yield (
+                    recipe_id, user_id, f'{name} №{number}', text,
+                    rng.randint(5, 180), '', {}, 0,
+                )
+                recipe_id += 1
+
+    def recipe_ingredient_rows(self):
+        rng = self.get_random('ingredients')
+        low, high = INGREDIENTS_PER_RECIPE
+        high = min(high, len(self.ingredient_ids))
+        for recipe_id in self.recipe_ids:
+            for ingredient_id in rng.sample(
+                self.ingredient_ids, rng.randint(min(low, high), high)
+            ):
+                yield recipe_id, ingredient_id, rng.randint(1, 500)
+
+    def recipe_tag_rows(self):
+        rng = self.get_random('tags')
+        low, high = TAGS_PER_RECIPE
+        high = min(high, len(self.tag_ids))
+        for recipe_id in self.recipe_ids:
+            for tag_id in rng.sample(self.tag_ids, rng.randint(low, high)):
+                yield recipe_id, tag_id
+
+    def get_popular(self, rng, items, weights, count):
+        """До count разных элементов, популярные выпадают чаще"""
+        return list(dict.fromkeys(
+            rng.choices(items, cum_weights=weights, k=count * 2)
+        ))[:count]
+
+    def follow_rows(self):
+        """Подписки: у немногих авторов - большая часть подписчиков"""
+        if not self.author_ids:
+            return
+        rng = self.get_random('follows')
+        authors = list(self.author_ids)
+        rng.shuffle(authors)
+        weights = zipf_weights(len(authors))
+        for user_id in self.user_ids:
+            count = self.power_count(rng, FOLLOWS_PER_USER, 1000)
+            for author_id in self.get_popular(rng, authors, weights, count):
+                if author_id != user_id:
+                    yield user_id, author_id
+
+    def user_recipe_rows(self, table, mean, limit):
+        """Избранное и корзины: популярные рецепты встречаются чаще"""
+        if not self.recipe_ids:
+            return
+        rng = self.get_random(table)
+        recipes = list(self.recipe_ids)
+        rng.shuffle(recipes)
+        weights = zipf_weights(len(recipes))
+        for user_id in self.user_ids:
+            count = self.power_count(rng, mean, limit)
+            for recipe_id in self.get_popular(rng, recipes, weights, count):
+                yield user_id, recipe_id
@@ -0,0 +1,22 @@
+from jobs.queue import task
+
+from .feed import fan_out_recipe
+from .images import update_recipe_renditions
+from .models import Recipe
+
+
+@task('recipe_renditions')
+def recipe_renditions(job, recipe_id):
+    """Варианты изображения рецепта"""
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is not None:
+        update_recipe_renditions(recipe)
+    return {'recipe': recipe_id}
+
+
+@task('feed_fan_out')
+def feed_fan_out(job, recipe_id, author_id, after):
+    """Рецепт в лентах подписчиков автора с id больше after"""
+    if Recipe.objects.filter(pk=recipe_id).exists():
+        fan_out_recipe(recipe_id, author_id, after)
+    return {'recipe': recipe_id}
@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from .catalog import iter_json_array
+from .models import Ingredient, RecipeIngredient, Tag
+
+
+class JsonArrayTest(SimpleTestCase):
+    """Потоковый разбор JSON-массива по кускам"""
+
+    def parse(self, text, chunk_size=3):
+        return list(iter_json_array(StringIO(text), chunk_size=chunk_size))
+
+    def test_items(self):
+        items = [
+            {'name': 'соль', 'measurement_unit': 'г'}, 12345, 'строка, ]',
+            [1, [2]], None,
+        ]
+        text = json.dumps(items, ensure_ascii=False)
+        for chunk_size in (1, 3, 7, len(text)):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.parse(text, chunk_size), items)
+        self.assertEqual(self.parse(' \n[ ]'), [])
+
+    def test_errors(self):
+        for text in ('{"name": "соль"}', '[1, 2', '[{"name": '):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.parse(text)
+
+
+class UpmodelsTest(TestCase):
+    """Загрузка каталога: повторный запуск обновляет, а не дублирует"""
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def load(self, *paths):
+        out = StringIO()
+        call_command('upmodels', *paths, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def get_units(self):
+        return dict(Ingredient.objects.values_list('name', 'measurement_unit'))
+
+    def test_rerun(self):
+        path = self.write(
+            'ingredients.csv', 'соль,г\nсахар,г\nмолоко,л\nмолоко, мл\n'
+        )
+        self.load(path)
+        self.assertEqual(
+            self.get_units(), {'соль': 'г', 'сахар': 'г', 'молоко': 'мл'}
+        )
+        self.assertIn(
+            'записей: 3, ингредиентов добавлено: 0, обновлено: 0,',
+            self.load(path)
+        )
+        json_path = self.write('ingredients.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'кг'},
+            {'name': 'перец', 'measurement_unit': 'г'},
+        ], ensure_ascii=False))
+        output = self.load(json_path)
+        self.assertIn('ингредиентов добавлено: 1, обновлено: 1', output)
+        self.assertEqual(self.get_units(), {
+            'соль': 'кг', 'сахар': 'г', 'молоко': 'мл', 'перец': 'г'
+        })
+
+    def test_fixture_ids(self):
+        """Ингредиенты и теги фикстуры сопоставляются с уже загруженными
+        по названию и slug, а ссылки на них - переписываются"""
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        path = self.write('data.json', json.dumps([
+            {'model': 'app.ingredient', 'pk': 500,
+             'fields': {'name': 'соль', 'measurement_unit': 'г'}},
+            {'model': 'app.tag', 'pk': 700,
+             'fields': {'name': 'Обед', 'color': '#000000',
+                        'slug': 'lunch'}},
+            {'model': 'users.user', 'pk': 900,
+             'fields': {'username': 'chef', 'email': 'chef@example.com',
+                        'first_name': 'Шеф', 'last_name': 'Повар',
+                        'password': ''}},
+            {'model': 'app.recipe', 'pk': 1000,
+             'fields': {'author': 900, 'name': 'Суп', 'text': 'Сварить',
+                        'cooking_time': 10, 'image': 'recipes/soup.jpg',
+                        'tags': [700]}},
+            {'model': 'app.recipeingredient', 'pk': 1100,
+             'fields': {'recipe': 1000, 'ingredient': 500, 'amount': 5}},
+        ], ensure_ascii=False))
+        self.load(path)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        link = RecipeIngredient.objects.get(pk=1100)
+        self.assertEqual(link.ingredient.name, 'соль')
+        self.assertEqual(
+            list(link.recipe.tags.values_list('slug', 'color')),
+            [('lunch', '#000000')]
+        )
+        self.assertEqual(link.recipe.author.recipes_count, 1)
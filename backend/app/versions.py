@@ -0,0 +1,68 @@
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from app.models import DataVersion
+
+# Области, измененные в текущей транзакции потока
+pending = threading.local()
+
+
+def get_timestamp():
+    return int(time.time() * 1000000)
+
+
+def get_versions(*scopes):
+    """Текущие версии областей данных: {scope: version}.
+
+    Версия - время последнего изменения данных области в микросекундах.
+    Версии хранятся в таблице DataVersion, общей для всех процессов.
+    Чтение ничего не пишет: у области без строки версия 0, строку
+    создает первое изменение (write_pending_versions).
+    """
+    versions = dict.fromkeys(scopes, 0)
+    versions.update(DataVersion.objects.filter(
+        scope__in=scopes
+    ).values_list('scope', 'version'))
+    return versions
+
+
+def bump_versions(*scopes):
+    """Отметить изменение данных в указанных областях.
+
+    Версия меняется после фиксации транзакции: иначе параллельный запрос
+    успел бы сохранить в кэш старые данные уже под новой версией.
+    Области копятся до фиксации и меняются одним UPDATE: первый
+    обработчик on_commit записывает все накопленные, остальные ничего
+    не делают. Области из откаченной транзакции запишутся со следующей
+    фиксацией - лишняя смена версии безопасна.
+    """
+    if not hasattr(pending, 'scopes'):
+        pending.scopes = set()
+    pending.scopes.update(scopes)
+    transaction.on_commit(write_pending_versions)
+
+
+def write_pending_versions():
+    """Записать накопленные версии.
+
+    Версия только растет, даже если часы процесса отстают от записавшего
+    ее. Строки областей, которых еще нет, создаются с версией 0 и
+    обновляются вторым UPDATE: параллельная вставка той же области
+    не мешает (ignore_conflicts).
+    """
+    scopes = getattr(pending, 'scopes', None)
+    if not scopes:
+        return
+    pending.scopes = set()
+    versions = DataVersion.objects.filter(scope__in=scopes)
+    version = Greatest(Value(get_timestamp()), F('version') + 1)
+    if versions.update(version=version) < len(scopes):
+        DataVersion.objects.bulk_create(
+            [DataVersion(scope=scope, version=0) for scope in scopes],
+            ignore_conflicts=True
+        )
+        versions.update(version=version)
@@ -1,7 +1,15 @@
 #!/bin/sh
 python manage.py makemigrations
 python manage.py migrate
+# Таблица кэша, если CACHE_BACKEND - DatabaseCache (CACHES в settings.py)
+python manage.py createcachetable
 python manage.py collectstatic --no-input
-gunicorn --bind 0:8000 foodgram.wsgi:application
+# SERVER_WORKER=uvicorn: ASGI с асинхронными представлениями чтения;
+# быстрее не работает (README, раздел ASGI), по умолчанию - WSGI
+if [ "$SERVER_WORKER" = "uvicorn" ]; then
+    gunicorn --bind 0:8000 -k uvicorn.workers.UvicornWorker foodgram.asgi:application
+else
+    gunicorn --bind 0:8000 foodgram.wsgi:application
+fi
 
 exec "$@"
\ No newline at end of file
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Чтение API обслуживается асинхронными представлениями
+os.environ.setdefault('ROOT_URLCONF', 'foodgram.urls_async')
 
 application = get_asgi_application()
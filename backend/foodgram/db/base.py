@@ -0,0 +1,84 @@
+from functools import partial
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from .pool import ConnectionPool, PoolTimeoutError, get_pool
+
+Database = base.Database
+
+
+def check_connection(connection):
+    """Проверка подключения перед повторной выдачей"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset_connection(connection):
+    """Откат незавершенной транзакции; False - подключение не вернуть"""
+    if connection.closed:
+        return False
+    try:
+        if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return connection.get_transaction_status() == TRANSACTION_STATUS_IDLE
+
+
+def close_connection(connection):
+    try:
+        connection.close()
+    except Database.Error:
+        pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом подключений в каждом процессе.
+
+    Django закрывает подключение в конце запроса (CONN_MAX_AGE = 0),
+    а здесь оно возвращается в пул и достается следующему запросу
+    воркера без нового TCP-соединения и авторизации. Настройки - ключ
+    POOL в DATABASES: SIZE (0 - без пула), TIMEOUT и CHECK_IDLE в секундах.
+    """
+    connection_pool = None
+
+    def get_connection_pool(self):
+        options = self.settings_dict.get('POOL') or {}
+        if self.alias == NO_DB_ALIAS or not options.get('SIZE'):
+            return None
+        return get_pool(
+            (self.alias, self.settings_dict['NAME']),
+            partial(
+                ConnectionPool, options['SIZE'], options.get('TIMEOUT', 5),
+                options.get('CHECK_IDLE', 10), check=check_connection,
+                reset=reset_connection, close=close_connection
+            )
+        )
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = self.get_connection_pool()
+        if self.connection_pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection = self.connection_pool.getconn(
+                partial(super().get_new_connection, conn_params)
+            )
+        except PoolTimeoutError as error:
+            raise Database.OperationalError(str(error)) from error
+        # Уровень изоляции уже установлен при открытии подключения
+        self.isolation_level = connection.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.connection_pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            return self.connection_pool.putconn(self.connection)
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Пулы текущего процесса: после fork воркера gunicorn создаются заново
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Пул подключений к БД одного процесса.
+
+    Свободные подключения выдаются в порядке LIFO, чтобы лишние
+    простаивали и не держали сервер. Подключение, простоявшее дольше
+    check_idle секунд, перед выдачей проверяется; неисправное
+    закрывается, и вместо него берется следующее или открывается новое.
+    """
+
+    def __init__(self, size, timeout, check_idle, check, reset, close):
+        self.size = size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.check = check
+        self.reset = reset
+        self.close = close
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.opened = 0
+        self.stats = dict.fromkeys((
+            'checkouts', 'created', 'waits', 'timeouts', 'connect_failures',
+            'health_check_failures', 'discarded',
+        ), 0)
+        self.stats.update(wait_time_total=0.0, wait_time_max=0.0)
+
+    def getconn(self, connect):
+        while True:
+            connection, returned_at = self.acquire()
+            if connection is None:
+                connection = self.open(connect)
+                break
+            idle = time.monotonic() - returned_at
+            if idle < self.check_idle or self.check(connection):
+                break
+            self.discard(connection, 'health_check_failures')
+        with self.condition:
+            self.stats['checkouts'] += 1
+        return connection
+
+    def acquire(self):
+        """Свободное подключение или (None, None), если можно открыть новое"""
+        started = time.monotonic()
+        with self.condition:
+            waited = False
+            while not self.idle and self.opened >= self.size:
+                waited = True
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f'Нет свободного подключения к БД за {self.timeout} с '
+                        f'(размер пула {self.size})'
+                    )
+            if waited:
+                wait_time = time.monotonic() - started
+                self.stats['waits'] += 1
+                self.stats['wait_time_total'] += wait_time
+                self.stats['wait_time_max'] = max(
+                    self.stats['wait_time_max'], wait_time
+                )
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+            return None, None
+
+    def open(self, connect):
+        try:
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.stats['connect_failures'] += 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.stats['created'] += 1
+        return connection
+
+    def putconn(self, connection):
+        if not self.reset(connection):
+            self.discard(connection, 'discarded')
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection, reason):
+        try:
+            self.close(connection)
+        finally:
+            with self.condition:
+                self.opened -= 1
+                self.stats[reason] += 1
+                self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats.update(
+                size=self.size, opened=self.opened, idle=len(self.idle),
+                in_use=self.opened - len(self.idle),
+            )
+        return stats
+
+
+def get_pool(key, factory):
+    """Пул по ключу для текущего процесса; factory создает новый"""
+    key = (os.getpid(), key)
+    with pools_lock:
+        if key not in pools:
+            pools[key] = factory()
+        return pools[key]
+
+
+def get_pools_stats():
+    """Статистика пулов текущего процесса"""
+    pid = os.getpid()
+    with pools_lock:
+        items = [(key, pool) for (owner, key), pool in pools.items()
+                 if owner == pid]
+    return [
+        {'pid': pid, 'alias': alias, 'database': name, **pool.get_stats()}
+        for (alias, name), pool in items
+    ]
@@ -0,0 +1,139 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from .pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """Пул подключений с поддельной фабрикой подключений"""
+
+    def setUp(self):
+        self.connections = []
+        self.checked = []
+
+    def connect(self):
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+    def check(self, connection):
+        self.checked.append(connection)
+        return connection.healthy
+
+    def close(self, connection):
+        connection.closed = True
+
+    def get_pool(self, size=2, timeout=1, check_idle=10):
+        return ConnectionPool(
+            size, timeout, check_idle, check=self.check,
+            reset=lambda connection: connection.healthy, close=self.close
+        )
+
+    def test_checkout_and_return(self):
+        pool = self.get_pool()
+        connection = pool.getconn(self.connect)
+        stats = pool.get_stats()
+        self.assertEqual(
+            (stats['opened'], stats['idle'], stats['in_use']), (1, 0, 1)
+        )
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(self.connect), connection)
+        stats = pool.get_stats()
+        self.assertEqual(
+            (stats['checkouts'], stats['created'], stats['opened']), (2, 1, 1)
+        )
+        self.assertEqual(self.checked, [])
+
+    def test_lifo(self):
+        pool = self.get_pool()
+        first = pool.getconn(self.connect)
+        second = pool.getconn(self.connect)
+        pool.putconn(first)
+        pool.putconn(second)
+        self.assertIs(pool.getconn(self.connect), second)
+        self.assertIs(pool.getconn(self.connect), first)
+        self.assertEqual(len(self.connections), 2)
+
+    def test_reset_failure(self):
+        pool = self.get_pool()
+        connection = pool.getconn(self.connect)
+        connection.healthy = False
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        stats = pool.get_stats()
+        self.assertEqual((stats['discarded'], stats['opened']), (1, 0))
+
+    @mock.patch('foodgram.db.pool.time.monotonic')
+    def test_idle_health_check(self, monotonic):
+        monotonic.return_value = 100
+        pool = self.get_pool(check_idle=10)
+        connection = pool.getconn(self.connect)
+        pool.putconn(connection)
+        # Простоявшее меньше check_idle не проверяется
+        monotonic.return_value = 105
+        pool.putconn(pool.getconn(self.connect))
+        self.assertEqual(self.checked, [])
+
+        monotonic.return_value = 120
+        self.assertIs(pool.getconn(self.connect), connection)
+        self.assertEqual(self.checked, [connection])
+        pool.putconn(connection)
+
+        # Неисправное закрывается, вместо него открывается новое
+        monotonic.return_value = 140
+        self.checked.clear()
+        connection.healthy = False
+        replacement = pool.getconn(self.connect)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.checked, [connection])
+        stats = pool.get_stats()
+        self.assertEqual(
+            (stats['health_check_failures'], stats['created'],
+             stats['opened']),
+            (1, 2, 1)
+        )
+
+    def test_overflow_timeout(self):
+        pool = self.get_pool(size=1, timeout=0.05)
+        pool.getconn(self.connect)
+        with self.assertRaises(PoolTimeoutError):
+            pool.getconn(self.connect)
+        stats = pool.get_stats()
+        self.assertEqual((stats['timeouts'], stats['opened']), (1, 1))
+        self.assertEqual(len(self.connections), 1)
+
+    def test_overflow_wait(self):
+        pool = self.get_pool(size=1, timeout=5)
+        connection = pool.getconn(self.connect)
+        timer = threading.Timer(0.05, pool.putconn, [connection])
+        timer.start()
+        self.assertIs(pool.getconn(self.connect), connection)
+        timer.join()
+        stats = pool.get_stats()
+        self.assertEqual((stats['waits'], stats['checkouts']), (1, 2))
+        self.assertGreater(stats['wait_time_max'], 0)
+        self.assertEqual(stats['wait_time_total'], stats['wait_time_max'])
+
+    def test_connect_failure(self):
+        pool = self.get_pool(size=1)
+
+        def connect():
+            raise OSError('connection refused')
+
+        with self.assertRaises(OSError):
+            pool.getconn(connect)
+        stats = pool.get_stats()
+        self.assertEqual((stats['connect_failures'], stats['opened']), (1, 0))
+        # Место в пуле освобождено
+        self.assertIsNotNone(pool.getconn(self.connect))
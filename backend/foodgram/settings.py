@@ -35,10 +35,12 @@ INSTALLED_APPS = [
     'app.apps.AppConfig',
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
+    'jobs.apps.JobsConfig',
     # -------------------------------
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -51,7 +53,8 @@ MIDDLEWARE = [
 
 CORS_ORIGIN_ALLOW_ALL = True
 
-ROOT_URLCONF = 'foodgram.urls'
+# Под ASGI (foodgram/asgi.py) по умолчанию foodgram.urls_async
+ROOT_URLCONF = os.getenv('ROOT_URLCONF', default='foodgram.urls')
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
@@ -76,15 +79,48 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql_psycopg2'),
+        # DB_ENGINE=foodgram.db - PostgreSQL с пулом подключений в каждом
+        # воркере (пока не проверен на рабочей базе, включается явно)
+        'ENGINE': os.getenv(
+            'DB_ENGINE', default='django.db.backends.postgresql_psycopg2'
+        ),
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
         'PORT': os.getenv('DB_PORT', default='5432'),
+        # Для foodgram.db: максимум подключений воркера, ожидание
+        # свободного (с) и простой, после которого подключение проверяется
+        # перед выдачей (с)
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE', default=10)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=5)),
+            'CHECK_IDLE': float(os.getenv('DB_POOL_CHECK_IDLE', default=10)),
+        },
     }
 }
 
+# Общие страницы списка рецептов (api/cache.py). Ключ страницы содержит
+# версии данных из таблицы DataVersion, общей для всех процессов, поэтому
+# кэш в памяти процесса не отдает устаревших страниц - у каждого воркера
+# лишь свои копии. CACHE_BACKEND и CACHE_LOCATION позволяют указать кэш,
+# общий для воркеров, например memcached
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith(('.LocMemCache', '.DatabaseCache')):
+    # Кэш в памяти вытесняет давно не использованные страницы, таблица
+    # в базе (createcachetable) - в порядке ключей
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=5000)),
+    }
+
 if DEBUG:
     AUTH_PASSWORD_VALIDATORS = []
 else:
@@ -128,7 +164,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
@@ -137,6 +173,45 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+# Кэш токенов (api.authentication): время жизни в памяти процесса
+# и в общем кэше, секунды. Общий кэш включается только для быстрого
+# кэша, общего для воркеров (memcached и т.п. в CACHES): с кэшем в базе
+# данных он не экономит запрос, а с кэшем в памяти процесса отозванный
+# токен действовал бы в других воркерах до AUTH_TOKEN_CACHE_TTL
+AUTH_TOKEN_LOCAL_TTL = int(os.getenv('AUTH_TOKEN_LOCAL_TTL', default=5))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', default=60))
+AUTH_TOKEN_SHARED_CACHE = os.getenv(
+    'AUTH_TOKEN_SHARED_CACHE', default='False'
+) == 'True'
+
+# Поиск ингредиентов: максимум результатов в выдаче и время жизни
+# индекса в памяти процесса (для баз данных без триграммного индекса)
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_INDEX_TTL = 300
+
+# Время жизни общих страниц списка рецептов в кэше (CACHES),
+# секунды; устаревшие страницы вытесняются раньше сменой версий данных
+RECIPES_CACHE_TIMEOUT = 300
+
+# Фоновые задачи (manage.py runjobs): пауза перед первым повтором упавшей
+# задачи и аренда выполняемой задачи. Обработчик продлевает аренду каждые
+# JOBS_HEARTBEAT_INTERVAL секунд; задача с истекшей арендой (обработчик
+# завершился аварийно) возвращается в очередь
+JOBS_RETRY_DELAY = 30
+JOBS_LEASE_TIMEOUT = 60
+JOBS_HEARTBEAT_INTERVAL = 15
+# Готовить варианты изображений фоновой задачей, а не во время запроса
+IMAGE_RENDITIONS_IN_BACKGROUND = os.getenv(
+    'IMAGE_RENDITIONS_IN_BACKGROUND', default='False'
+) == 'True'
+
+# Потоки для асинхронных представлений чтения под ASGI (SERVER_WORKER=uvicorn,
+# выигрыша в скорости не дает, см. README)
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', default=16))
+# Превышение бюджета запросов к БД (query_budgets представлений) вызывает
+# ошибку, а не только запись в лог; включается в тестах
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', default='False') == 'True'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=2),
     'AUTH_HEADER_TYPES': ('Bearer',),
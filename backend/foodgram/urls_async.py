@@ -0,0 +1,9 @@
+"""URL проекта для ASGI: чтение API через асинхронные представления"""
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('api.async_urls')),
+    *sync_urlpatterns,
+]
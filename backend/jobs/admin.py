@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'user', 'status', 'attempts', 'run_after',
+                    'updated']
+    list_filter = ['status', 'name']
+    search_fields = ['name', 'user__username']
@@ -0,0 +1,93 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobs.queue import claim_job, extend_leases, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Обработчик фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=2,
+            help='Количество параллельных обработчиков'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между проверками пустой очереди (секунды)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить задачи из очереди и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *args: self.stop.set())
+
+        # Выполняемые задачи этого процесса, id -> Job
+        self.running = {}
+        self.running_lock = threading.Lock()
+        self.requeue()
+
+        workers = [
+            threading.Thread(target=self.work, args=(options,), daemon=True)
+            for _ in range(max(options['concurrency'], 1))
+        ]
+        heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+        for worker in workers:
+            worker.start()
+        heartbeat.start()
+        for worker in workers:
+            worker.join()
+        self.stop.set()
+        heartbeat.join()
+        self.stdout.write(self.style.SUCCESS('Обработчик остановлен'))
+
+    def requeue(self):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь задач: {requeued}')
+
+    def heartbeat(self):
+        """Каждые JOBS_HEARTBEAT_INTERVAL секунд продлевать аренду своих
+        задач и возвращать в очередь задачи с истекшей арендой"""
+        try:
+            while not self.stop.wait(settings.JOBS_HEARTBEAT_INTERVAL):
+                close_old_connections()
+                with self.running_lock:
+                    jobs = list(self.running.values())
+                try:
+                    extend_leases(jobs)
+                    self.requeue()
+                except Exception as error:
+                    # Временная ошибка БД: повтор на следующем шаге
+                    self.stderr.write(f'Ошибка продления аренды: {error}')
+        finally:
+            connection.close()
+
+    def work(self, options):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                job = claim_job()
+                if job is None:
+                    if options['once']:
+                        return
+                    self.stop.wait(options['poll_interval'])
+                    continue
+                with self.running_lock:
+                    self.running[job.pk] = job
+                try:
+                    job = run_job(job)
+                finally:
+                    with self.running_lock:
+                        del self.running[job.pk]
+                self.stdout.write(str(job))
+        finally:
+            connection.close()
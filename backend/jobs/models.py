@@ -0,0 +1,51 @@
+from django.db import models
+from django.utils import timezone
+
+from users.models import User
+
+
+class Job(models.Model):
+    """Фоновая задача, выполняемая командой runjobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField('Задача', max_length=100)
+    payload = models.JSONField('Параметры', default=dict, blank=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='jobs', verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        'Статус', max_length=10, choices=STATUSES, default=PENDING
+    )
+    result = models.JSONField('Результат', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        'Максимум попыток', default=3
+    )
+    run_after = models.DateTimeField('Запустить после', default=timezone.now)
+    lease_until = models.DateTimeField('Аренда до', null=True, blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    updated = models.DateTimeField('Изменена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('-id',)
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'], name='job_queue_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} | {self.get_status_display()}'
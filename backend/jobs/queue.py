@@ -0,0 +1,107 @@
+import traceback
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+
+
+def task(name):
+    """Регистрация функции как фоновой задачи с именем name.
+
+    Функция получает объект Job и параметры задачи, а ее результат
+    (JSON-совместимый) сохраняется в Job.result.
+    """
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, user=None, max_attempts=3, **payload):
+    """Поставить задачу в очередь"""
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача: {name}')
+    return Job.objects.create(
+        name=name, user=user, payload=payload, max_attempts=max_attempts
+    )
+
+
+def get_lease_until():
+    return timezone.now() + timedelta(seconds=settings.JOBS_LEASE_TIMEOUT)
+
+
+def claim_job():
+    """Взять следующую задачу из очереди.
+
+    Задачу забирает тот, чей условный UPDATE изменил строку, поэтому
+    одну задачу не выполнят два обработчика одновременно. Задача
+    берется в аренду на JOBS_LEASE_TIMEOUT секунд (см. extend_leases).
+    """
+    while True:
+        job = Job.objects.filter(
+            status=Job.PENDING, run_after__lte=timezone.now()
+        ).order_by('run_after', 'id').first()
+        if job is None:
+            return None
+        claimed = Job.objects.filter(pk=job.pk, status=Job.PENDING).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1,
+            lease_until=get_lease_until(), updated=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """Выполнить задачу; при ошибке повторить позже с нарастающей паузой"""
+    try:
+        func = TASKS[job.name]
+        job.result = func(job, **job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(
+                seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+    else:
+        job.status = Job.DONE
+        job.error = ''
+    job.lease_until = None
+    job.save(update_fields=[
+        'status', 'result', 'error', 'run_after', 'lease_until', 'updated'
+    ])
+    return job
+
+
+def extend_leases(jobs):
+    """Продлить аренду выполняемых задач одним запросом.
+
+    Продлевается только своя аренда: задачу, которую после истечения
+    аренды вернули в очередь и взял другой обработчик, выдает счетчик
+    попыток.
+    """
+    if not jobs:
+        return 0
+    return Job.objects.filter(
+        reduce(or_, (Q(pk=job.pk, attempts=job.attempts) for job in jobs)),
+        status=Job.RUNNING
+    ).update(lease_until=get_lease_until())
+
+
+def requeue_stale_jobs():
+    """Вернуть в очередь задачи с истекшей арендой: их обработчик
+    завершился аварийно или завис"""
+    return Job.objects.filter(
+        Q(lease_until__lt=timezone.now()) | Q(lease_until__isnull=True),
+        status=Job.RUNNING
+    ).update(status=Job.PENDING, lease_until=None, updated=timezone.now())
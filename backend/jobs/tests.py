@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import (claim_job, enqueue, extend_leases, requeue_stale_jobs,
+                    run_job, task)
+
+
+@task('test_sleep')
+def sleep_task(job, seconds=0):
+    time.sleep(seconds)
+    return job.pk
+
+
+class LeaseTest(TestCase):
+    """Аренда выполняемых задач и возврат в очередь по ее истечении"""
+
+    def setUp(self):
+        self.job = enqueue('test_sleep')
+
+    def expire(self, job):
+        Job.objects.filter(pk=job.pk).update(
+            lease_until=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_claim(self):
+        job = claim_job()
+        self.assertEqual((job.pk, job.status), (self.job.pk, Job.RUNNING))
+        self.assertGreater(job.lease_until, timezone.now())
+        job = run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_until), (Job.DONE, None))
+
+    def test_requeue_stale_jobs(self):
+        job = claim_job()
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.expire(job)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_until), (Job.PENDING, None))
+
+    def test_extend_leases(self):
+        job = claim_job()
+        self.expire(job)
+        self.assertEqual(extend_leases([job]), 1)
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        # Задачу с истекшей арендой взял другой обработчик
+        self.expire(job)
+        requeue_stale_jobs()
+        claimed = claim_job()
+        self.assertEqual(claimed.attempts, job.attempts + 1)
+        self.expire(claimed)
+        self.assertEqual(extend_leases([job]), 0)
+        self.assertEqual(extend_leases([]), 0)
+
+
+@override_settings(JOBS_HEARTBEAT_INTERVAL=0.02)
+class RunJobsTest(TransactionTestCase):
+    """runjobs возвращает в очередь задачи, аренда которых истекла
+    во время работы, а не только при запуске"""
+
+    def test_requeue_while_running(self):
+        # Задача обработчика, который завершился вскоре после запуска
+        # runjobs: аренда еще действует при запуске
+        stale = enqueue('test_sleep')
+        Job.objects.filter(pk=stale.pk).update(
+            status=Job.RUNNING, attempts=1,
+            lease_until=timezone.now() + timedelta(seconds=0.05)
+        )
+        # Выполняется дольше аренды: аренду продлевает обработчик
+        slow = enqueue('test_sleep', seconds=0.4)
+        Job.objects.filter(pk=slow.pk).update(
+            run_after=timezone.now() - timedelta(seconds=1)
+        )
+        out = StringIO()
+        with override_settings(JOBS_LEASE_TIMEOUT=0.15):
+            call_command('runjobs', once=True, concurrency=1, stdout=out)
+        self.assertEqual(out.getvalue().count('Возвращено в очередь'), 1)
+        self.assertIn('Возвращено в очередь задач: 1\n', out.getvalue())
+        self.assertEqual(
+            dict(Job.objects.values_list('pk', 'status')),
+            {stale.pk: Job.DONE, slow.pk: Job.DONE}
+        )
+        self.assertEqual(Job.objects.get(pk=slow.pk).attempts, 1)
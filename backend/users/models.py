@@ -37,6 +37,9 @@ class User(AbstractUser):
             )
         ],
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0, editable=False
+    )
 
     USERNAME_FIELD = 'username'
     EMAIL_FIELD = 'email'
@@ -77,3 +80,9 @@ class Follow(models.Model):
                 name='unique_follow'
             )
         ]
+        indexes = [
+            # Подписчики автора по порядку id (app/feed.py)
+            models.Index(
+                fields=['following', 'follower'], name='follow_following_idx'
+            )
+        ]